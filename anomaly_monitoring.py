@@ -1,19 +1,129 @@
-import asyncio
 import json
-import logging
-import re
+import time
 from collections import defaultdict
-from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Set
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Optional, Set, Union
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import WebSocket
 
-# Налаштування логування
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", filename="websocket_monitor.log"
-)
-logger = logging.getLogger(__name__)
+from utils import config
+from utils.logging_config import logger
+from utils.timer_wheel import timer_wheel
+
+
+@dataclass
+class TokenBucket:
+    """
+    Token bucket на монотонному годиннику: поповнюється на `rate` токенів за секунду до `capacity`.
+    Оновлення за O(1) - замість історії повідомлень зберігається лише кількість токенів і час останнього поповнення
+    """
+
+    rate: float
+    capacity: float
+    tokens: float = None
+    updated_at: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        if self.tokens is None:
+            self.tokens = self.capacity
+
+    @classmethod
+    def per_minute(cls, limit: int, burst: int) -> Optional["TokenBucket"]:
+        """None, якщо ліміт вимкнено (0)"""
+        return cls(rate=limit / 60, capacity=max(burst, 1)) if limit > 0 else None
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def consume(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def time_until_full(self, now: float) -> float:
+        self._refill(now)
+        return (self.capacity - self.tokens) / self.rate
+
+
+class SuspiciousContentScanner:
+    """
+    Пошук підозрілого контенту без backtracking: літерали шукаються через `find` в одній копії повідомлення в нижньому
+    регістрі, а `<script` та `eval(` підтверджуються пошуком `>`/`</script>` та `)` далі в тексті - з тим самим
+    результатом, що й `<script.*?>.*?</script>` (DOTALL) та `eval` з дужками в одному рядку, але за лінійний час.
+    Перевіряються лише перші `max_scan_size` символів (байтів), а скан зупиняється після `time_budget` секунд
+    """
+
+    # Не-ASCII літери, які re.IGNORECASE вважає рівними літерам шуканих слів: "İ" та "ı" - "i", "ſ" - "s"
+    CASE_FOLDS = {"\u0130": "i", "\u0131": "i", "\u017f": "s"}
+
+    def __init__(self, max_scan_size: int, time_budget: float) -> None:
+        self.max_scan_size = max_scan_size
+        self.time_budget = time_budget
+        self.needles = {
+            kind: {
+                needle: needle if kind is str else needle.encode()
+                for needle in ("javascript:", "onload=", "onerror=", "<script", ">", "</script>", "eval(", ")", "\n")
+            }
+            for kind in (str, bytes)
+        }
+        self.case_folds = str.maketrans(self.CASE_FOLDS)
+        self.scanned = 0
+        self.truncated = 0
+        self.timed_out = 0
+
+    def is_suspicious(self, message: Union[str, bytes]) -> bool:
+        self.scanned += 1
+        needles = self.needles[type(message)]
+        end = len(message)
+        if end > self.max_scan_size:
+            self.truncated += 1
+            end = self.max_scan_size
+        lowered = self._fold(message[:end]).lower()
+
+        for needle in ("javascript:", "onload=", "onerror="):
+            if needles[needle] in lowered:
+                return True
+
+        # Лише перший `<script` має значення: у нього найраніший `>`, після якого шукається `</script>`
+        script = lowered.find(needles["<script"])
+        if script != -1:
+            tag_end = lowered.find(needles[">"], script + 7)
+            if tag_end != -1 and lowered.find(needles["</script>"], tag_end + 1) != -1:
+                return True
+
+        # `eval(` чутливий до регістру, а дужка має закритися в тому ж рядку
+        deadline = time.perf_counter() + self.time_budget
+        call = message.find(needles["eval("], 0, end)
+        while call != -1:
+            closing = message.find(needles[")"], call + 5, end)
+            if closing == -1:
+                return False
+            line_end = message.find(needles["\n"], call + 5, closing)
+            if line_end == -1:
+                return True
+            if time.perf_counter() > deadline:
+                self.timed_out += 1
+                return False
+            # Усі `eval(` до цього переносу рядка мають ту саму дужку за ним
+            call = message.find(needles["eval("], line_end + 1, end)
+        return False
+
+    def _fold(self, message: Union[str, bytes]) -> Union[str, bytes]:
+        if isinstance(message, str):
+            return message if message.isascii() else message.translate(self.case_folds)
+        # У UTF-8 ці літери починаються з байтів 0xC4 та 0xC5
+        if b"\xc4" in message or b"\xc5" in message:
+            for letter, folded in self.CASE_FOLDS.items():
+                message = message.replace(letter.encode(), folded.encode())
+        return message
 
 
 @dataclass
@@ -25,7 +135,7 @@ class ConnectionMetrics:
     message_count: int = 0
     last_message_time: Optional[datetime] = None
     alerts: list = None
-    messages_per_minute: float = 0.0
+    rate_limit: Optional[TokenBucket] = None
 
     def __post_init__(self):
         if self.alerts is None:
@@ -36,29 +146,33 @@ class WebSocketMonitor:
     def __init__(self):
         # Налаштування порогових значень
         self.thresholds = {
-            "max_messages_per_minute": 100,
-            "max_connections_per_ip": 5,
-            "max_message_size": 1024 * 1024,  # 1MB
-            "min_message_interval": 0.05,  # 50ms
-            "suspicious_patterns": [
-                re.compile(r"<script.*?>.*?</script>", re.I | re.S),
-                re.compile(r"eval\(.*?\)"),
-                re.compile(r"javascript:", re.I),
-                re.compile(r"onload=", re.I),
-                re.compile(r"onerror=", re.I),
-            ],
+            # Середня частота та допустимий сплеск повідомлень, 0 вимикає ліміт
+            "max_messages_per_minute": config.WEBSOCKET_RATE_LIMIT_PER_MINUTE,
+            "message_burst": config.WEBSOCKET_RATE_LIMIT_BURST,
+            "max_ip_messages_per_minute": config.WEBSOCKET_IP_RATE_LIMIT_PER_MINUTE,
+            "ip_message_burst": config.WEBSOCKET_IP_RATE_LIMIT_BURST,
+            "max_connections_per_ip": config.WEBSOCKET_MAX_CONNECTIONS_PER_IP,
+            # Тривалість блокування IP, що вичерпав свій ліміт, 0 вимикає блокування
+            "ip_ban_time": config.WEBSOCKET_IP_BAN_SECONDS,
+            # Той самий тайм-аут, що й у ConnectionManager, 0 не обмежує час неактивності
+            "max_idle_time": config.WEBSOCKET_IDLE_TIMEOUT,
         }
+        self.scanner = SuspiciousContentScanner(
+            max_scan_size=config.SUSPICIOUS_CONTENT_MAX_SCAN_SIZE,
+            time_budget=config.SUSPICIOUS_CONTENT_SCAN_BUDGET_MS / 1000,
+        )
 
         # Зберігання активних з'єднань та метрик
         self.connections: Dict[WebSocket, ConnectionMetrics] = {}
         self.ip_connections: Dict[str, Set[WebSocket]] = defaultdict(set)
+        # Ліміти частоти повідомлень з IP, спільні для всіх його з'єднань
+        self.ip_rate_limits: Dict[str, TokenBucket] = {}
+        self.rate_limited_messages = 0
+        self.suspicious_messages = 0
 
         # Заблоковані IP
         self.blocked_ips: Set[str] = set()
 
-        # Запуск фонового завдання для очищення старих даних
-        asyncio.create_task(self._cleanup_old_data())
-
     async def handle_new_connection(self, websocket: WebSocket, ip: str) -> bool:
         """Обробка нового WebSocket з'єднання"""
         # Перевірка чи IP не заблокований
@@ -67,72 +181,89 @@ class WebSocketMonitor:
             return False
 
         # Перевірка кількості з'єднань з IP
-        if len(self.ip_connections[ip]) >= self.thresholds["max_connections_per_ip"]:
+        max_connections = self.thresholds["max_connections_per_ip"]
+        if max_connections and len(self.ip_connections.get(ip, ())) >= max_connections:
             logger.warning(f"Too many connections from IP: {ip}")
             await self._handle_violation(ip, "Too many connections", severity="medium")
             return False
 
         # Створення нових метрик для з'єднання
-        self.connections[websocket] = ConnectionMetrics(ip=ip, connect_time=datetime.now())
+        self.connections[websocket] = ConnectionMetrics(
+            ip=ip,
+            connect_time=datetime.now(),
+            rate_limit=TokenBucket.per_minute(
+                self.thresholds["max_messages_per_minute"], self.thresholds["message_burst"]
+            ),
+        )
         self.ip_connections[ip].add(websocket)
+        # Метрики з'єднання, неактивного протягом max_idle_time, видаляються таймером (спільним з ConnectionManager)
+        if self.thresholds["max_idle_time"]:
+            timer_wheel.schedule(
+                ("monitor", websocket), self.thresholds["max_idle_time"], lambda: self.handle_disconnect(websocket)
+            )
+        timer_wheel.cancel(("monitor-ip", ip))
+        if ip not in self.ip_rate_limits:
+            ip_rate_limit = TokenBucket.per_minute(
+                self.thresholds["max_ip_messages_per_minute"], self.thresholds["ip_message_burst"]
+            )
+            if ip_rate_limit is not None:
+                self.ip_rate_limits[ip] = ip_rate_limit
 
         logger.info(f"New connection established from IP: {ip}")
         return True
 
-    async def handle_message(self, websocket: WebSocket, message: str) -> bool:
+    async def handle_message(self, websocket: WebSocket, message: Union[str, bytes]) -> bool:
         """Обробка вхідного повідомлення"""
         if websocket not in self.connections:
             return False
 
         metrics = self.connections[websocket]
-        current_time = datetime.now()
 
         # Оновлення метрик
         metrics.message_count += 1
-        if metrics.last_message_time:
-            interval = (current_time - metrics.last_message_time).total_seconds()
-            if interval < self.thresholds["min_message_interval"]:
-                await self._handle_violation(
-                    metrics.ip, "Message interval too small", websocket=websocket, severity="low"
-                )
-
-        metrics.last_message_time = current_time
-
-        # Перевірки
-        violations = []
-
-        # Перевірка розміру повідомлення
-        if len(message.encode("utf-8")) > self.thresholds["max_message_size"]:
-            violations.append("Message size exceeded")
-
-        # Перевірка частоти повідомлень
-        time_connected = (current_time - metrics.connect_time).total_seconds() / 60
-        metrics.messages_per_minute = metrics.message_count / time_connected if time_connected > 0 else 0
-
-        if metrics.messages_per_minute > self.thresholds["max_messages_per_minute"]:
-            violations.append("Message rate exceeded")
-
-        # Перевірка на підозрілий контент
-        for pattern in self.thresholds["suspicious_patterns"]:
-            if pattern.search(message):
-                violations.append("Suspicious content detected")
-                break
-
-        # Обробка порушень
-        if violations:
-            severity = "high" if len(violations) > 1 else "medium"
-            await self._handle_violation(metrics.ip, ", ".join(violations), websocket=websocket, severity=severity)
+        metrics.last_message_time = datetime.now()
+        timer_wheel.extend(("monitor", websocket), self.thresholds["max_idle_time"])
+
+        # Розмір повідомлення перевіряється раніше, до декодування (main.check_connection)
+
+        # Перевірка частоти повідомлень: спершу ліміт з'єднання, потім спільний ліміт IP
+        now = time.monotonic()
+        ip_rate_limit = self.ip_rate_limits.get(metrics.ip)
+        connection_limited = metrics.rate_limit is not None and not metrics.rate_limit.consume(now)
+        ip_limited = not connection_limited and ip_rate_limit is not None and not ip_rate_limit.consume(now)
+        if connection_limited or ip_limited:
+            self.rate_limited_messages += 1
+            # Вичерпаний ліміт IP блокує IP на ip_ban_time, ліміт з'єднання закриває лише це з'єднання
+            severity = "high" if ip_limited else "medium"
+            await self._handle_violation(metrics.ip, "Message rate exceeded", websocket=websocket, severity=severity)
             return False
 
+        # Підозрілий контент лише записується: звичайний текст чату (напр. "eval(1+1)") не має закривати з'єднання
+        if self.scanner.is_suspicious(message):
+            self.suspicious_messages += 1
+            await self._handle_violation(metrics.ip, "Suspicious content detected", websocket=websocket)
+
         return True
 
     async def handle_disconnect(self, websocket: WebSocket):
         """Обробка відключення клієнта"""
         if websocket in self.connections:
             metrics = self.connections[websocket]
+            timer_wheel.cancel(("monitor", websocket))
             self.ip_connections[metrics.ip].remove(websocket)
             if not self.ip_connections[metrics.ip]:
                 del self.ip_connections[metrics.ip]
+                # Ліміт IP з невитраченими токенами лишається, доки не поповниться, інакше перепідключення
+                # обнуляло б його
+                ip_rate_limit = self.ip_rate_limits.get(metrics.ip)
+                if ip_rate_limit is not None and ip_rate_limit.is_full(time.monotonic()):
+                    del self.ip_rate_limits[metrics.ip]
+                elif ip_rate_limit is not None:
+                    timer_wheel.schedule(
+                        ("monitor-ip", metrics.ip),
+                        ip_rate_limit.time_until_full(time.monotonic()),
+                        lambda: self._release_ip_rate_limit(metrics.ip),
+                    )
             del self.connections[websocket]
             logger.info(f"Connection closed for IP: {metrics.ip}")
 
@@ -147,16 +278,14 @@ class WebSocketMonitor:
         if websocket and websocket in self.connections:
             self.connections[websocket].alerts.append(alert)
 
-        if severity == "high":
+        # З'єднання з порушенням "medium" закриває той, хто викликав перевірку
+        if severity == "high" and self.thresholds["ip_ban_time"]:
             self.blocked_ips.add(ip)
+            timer_wheel.schedule(("monitor-ban", ip), self.thresholds["ip_ban_time"], lambda: self._unblock_ip(ip))
             # Закриття всіх з'єднань з цього IP
             for ws in self.ip_connections.get(ip, set()).copy():
                 await self._close_connection(ws, 1008, "Security violation")
 
-        elif severity == "medium":
-            if websocket:
-                await self._close_connection(websocket, 1003, "Security violation")
-
         # Запис у лог
         logger.warning(json.dumps(alert))
 
@@ -172,18 +301,15 @@ class WebSocketMonitor:
         finally:
             await self.handle_disconnect(websocket)
 
-    async def _cleanup_old_data(self):
-        """Фонове завдання для очищення старих даних"""
-        while True:
-            try:
-                current_time = datetime.now()
-                # Видалення з'єднань, неактивних протягом години
-                for websocket, metrics in list(self.connections.items()):
-                    if metrics.last_message_time and current_time - metrics.last_message_time > timedelta(hours=1):
-                        await self.handle_disconnect(websocket)
-            except Exception as e:
-                logger.error(f"Error in cleanup task: {e}")
-            await asyncio.sleep(300)  # Перевірка кожні 5 хвилин
+    def _unblock_ip(self, ip: str):
+        """Зняття блокування IP після ip_ban_time"""
+        self.blocked_ips.discard(ip)
+        logger.info(f"IP unblocked: {ip}")
+
+    def _release_ip_rate_limit(self, ip: str):
+        """Видалення поповненого ліміту IP без активних з'єднань"""
+        if ip not in self.ip_connections:
+            self.ip_rate_limits.pop(ip, None)
 
     async def _send_alert_notification(self, alert: dict):
         """Надсилання сповіщень про порушення"""
@@ -197,67 +323,4 @@ class WebSocketMonitor:
         pass
 
 
-# Приклад використання з FastAPI
-app = FastAPI()
 monitor = WebSocketMonitor()
-
-
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    # Отримання IP клієнта
-    client_ip = websocket.client.host
-
-    # Прийняття з'єднання
-    if not await monitor.handle_new_connection(websocket, client_ip):
-        await websocket.close(code=1008, reason="Connection rejected")
-        return
-
-    await websocket.accept()
-
-    try:
-        while True:
-            message = await websocket.receive_text()
-
-            # Перевірка повідомлення
-            if not await monitor.handle_message(websocket, message):
-                await websocket.close(code=1008, reason="Message rejected")
-                break
-
-            # Обробка повідомлення...
-            await websocket.send_text(f"Message received: {message}")
-
-    except WebSocketDisconnect:
-        await monitor.handle_disconnect(websocket)
-    except Exception as e:
-        logger.error(f"Error in WebSocket connection: {e}")
-        await monitor.handle_disconnect(websocket)
-
-
-# Додаткові ендпоінти для адміністрування
-@app.get("/monitor/stats")
-async def get_monitor_stats():
-    """Отримання статистики моніторингу"""
-    stats = {
-        "active_connections": len(monitor.connections),
-        "connections_per_ip": {ip: len(connections) for ip, connections in monitor.ip_connections.items()},
-        "blocked_ips": list(monitor.blocked_ips),
-    }
-    return stats
-
-
-@app.post("/monitor/block-ip/{ip}")
-async def block_ip(ip: str):
-    """Ручне блокування IP"""
-    monitor.blocked_ips.add(ip)
-    # Закриття всіх активних з'єднань з цього IP
-    if ip in monitor.ip_connections:
-        for websocket in monitor.ip_connections[ip].copy():
-            await monitor._close_connection(websocket, 1008, "IP blocked")
-    return {"status": "success", "message": f"IP {ip} blocked"}
-
-
-@app.post("/monitor/unblock-ip/{ip}")
-async def unblock_ip(ip: str):
-    """Розблокування IP"""
-    monitor.blocked_ips.discard(ip)
-    return {"status": "success", "message": f"IP {ip} unblocked"}
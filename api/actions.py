@@ -1,13 +1,14 @@
-from pprint import pprint
-from uuid import UUID
+from datetime import datetime, timezone
+from typing import Optional
+from uuid import UUID, uuid4
 
 from fastapi import Depends, WebSocket
 from jwt import PyJWTError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 
 from api.auth import (
+    bind_principal,
     blacklist_token,
     create_jwt_token,
     encrypt_jwt,
@@ -15,13 +16,17 @@ from api.auth import (
     get_password_hash,
     is_token_blacklisted,
     oauth2_scheme,
+    password_hashing_executor,
     verify_token,
     verify_user,
 )
+from api.conversations import conversation_cache
 from api.crud import chat as chat_crud
 from api.crud import user as user_crud
 from api.exceptions import WebSocketValidationException
-from api.models import Chat, Message, User
+from api.membership import chat_membership, get_chat_participants
+from api.message_writer import message_writer
+from api.models import Chat, User
 from api.schemas.auth import AuthResponse, LoginData, RegisterData
 from api.schemas.chat import (
     ChatCreate,
@@ -36,11 +41,16 @@ from api.schemas.message import (
     WebsocketMessageCreateResponse,
     WebsocketMessagesResponse,
 )
-from api.schemas.user import MeSchema, UserCreate, UserLogin, WebsocketUserResponse
+from api.schemas.user import (
+    GetUsers,
+    MeSchema,
+    UserCreate,
+    UserLogin,
+    WebsocketUserResponse,
+)
 from engine import get_db
-from managers import manager
+from managers import Principal, manager
 from utils.enums import WebSocketActions
-from utils.utils import remove_websocket_by_value
 
 
 async def check_blacklisted_token(action: str, db: AsyncSession, token: str):
@@ -56,12 +66,15 @@ async def register(user_create: UserCreate, db: AsyncSession, websocket: WebSock
             action=WebSocketActions.REGISTER,
         )
 
-    hashed_password = get_password_hash(user_create.password)
+    # Return the connection to the pool while the password is hashed
+    await db.commit()
+    hashed_password = await password_hashing_executor.run(get_password_hash, user_create.password)
     registered_user = await user_crud.create_user(db, user_create.email, user_create.nickname, hashed_password)
 
     access_token = create_jwt_token(user_create.email)
     encrypted_token = encrypt_jwt(access_token)
-    manager.socket_to_user[registered_user.uuid] = websocket
+    await bind_principal(websocket, Principal.from_user(registered_user), access_token)
+    manager.remember_decrypted_token(websocket, encrypted_token, access_token)
 
     return AuthResponse(
         action=WebSocketActions.REGISTER,
@@ -82,7 +95,8 @@ async def login(login_form: UserLogin, db: AsyncSession, websocket: WebSocket):
     access_token = create_jwt_token(user.email)
     encrypted_token = encrypt_jwt(access_token)
 
-    manager.socket_to_user[user.uuid] = websocket
+    await bind_principal(websocket, Principal.from_user(user), access_token)
+    manager.remember_decrypted_token(websocket, encrypted_token, access_token)
 
     return AuthResponse(
         action=WebSocketActions.LOGIN,
@@ -92,22 +106,9 @@ async def login(login_form: UserLogin, db: AsyncSession, websocket: WebSocket):
     )
 
 
-async def me(db: AsyncSession, token: str = Depends(oauth2_scheme)):
+async def me(db: AsyncSession, token: str = Depends(oauth2_scheme), websocket: Optional[WebSocket] = None):
     await check_blacklisted_token(action=WebSocketActions.ME, db=db, token=token)
-    try:
-        email = verify_token(token)
-    except PyJWTError:
-        raise WebSocketValidationException(
-            detail="Invalid token!",
-            action=WebSocketActions.ME,
-        )
-
-    user = await user_crud.get_user_by_email(db, email)
-    if not user:
-        raise WebSocketValidationException(
-            detail="User not found!",
-            action=WebSocketActions.ME,
-        )
+    user = await get_current_user_via_websocket(token=token, db=db, action=WebSocketActions.ME, websocket=websocket)
 
     return AuthResponse(
         action=WebSocketActions.ME, data=MeSchema(email=user.email, nickname=user.nickname, user_uuid=str(user.uuid))
@@ -124,44 +125,71 @@ async def logout(websocket: WebSocket, db: AsyncSession = Depends(get_db), token
             action=WebSocketActions.LOGOUT,
         )
 
-    remove_websocket_by_value(manager.socket_to_user, websocket)
+    await manager.unbind_user(websocket)
+    await blacklist_token(db, token)
 
-    if not await is_token_blacklisted(db, token):
-        await blacklist_token(db, token)
 
-
-async def get_chats_list(db: AsyncSession, token: str):
+async def get_chats_list(
+    db: AsyncSession, token: str, websocket: Optional[WebSocket] = None, since: Optional[str] = None
+):
     await check_blacklisted_token(action=WebSocketActions.GET_CHATS, db=db, token=token)
-    user = await get_current_user_via_websocket(token=token, db=db, action=WebSocketActions.GET_CHATS)
+    user = await get_current_user_via_websocket(
+        token=token, db=db, action=WebSocketActions.GET_CHATS, websocket=websocket
+    )
     if not user:
         raise WebSocketValidationException(
             detail="User not found!",
             action=WebSocketActions.GET_CHATS,
         )
+
+    conversations = conversation_cache.get(user.uuid)
+    if conversations is None:
+        conversation_cache.begin_load(user.uuid)
+        chats = await chat_crud.get_chats_for_user(user_uuid=user.uuid, db=db)
+        conversations = conversation_cache.finish_load(user.uuid, chats)
+
+    changed_chats = conversations.changed_since(since) if since else None
     return WebsocketChatResponse(
         action=WebSocketActions.GET_CHATS,
-        data={"chats": await chat_crud.get_chats_for_user(user_uuid=user.uuid, db=db)},
+        data={"chats": changed_chats if changed_chats is not None else conversations.all()},
+        version=conversations.token,
+        incremental=changed_chats is not None,
     )
 
 
-async def get_users(db: AsyncSession, token: str):
+async def get_users(users_data: GetUsers, db: AsyncSession, token: str, websocket: Optional[WebSocket] = None):
     await check_blacklisted_token(action=WebSocketActions.GET_USERS, db=db, token=token)
-    user = await get_current_user_via_websocket(token=token, db=db, action=WebSocketActions.GET_CHATS)
-    pprint(manager.socket_to_user)
+    user = await get_current_user_via_websocket(
+        token=token, db=db, action=WebSocketActions.GET_USERS, websocket=websocket
+    )
     if not user:
         raise WebSocketValidationException(
             detail="User not found!",
             action=WebSocketActions.GET_USERS,
         )
-    return WebsocketUserResponse(
-        action=WebSocketActions.GET_USERS,
-        data={"users": await user_crud.get_users_list(request_user_uuid=user.uuid, db=db)},
+
+    page = await user_crud.get_users_list(
+        request_user_id=user.id,
+        db=db,
+        limit=users_data.limit,
+        search=users_data.search,
+        after=users_data.after,
     )
+    if page is None:
+        raise WebSocketValidationException(
+            detail="Cursor user not found!",
+            action=WebSocketActions.GET_USERS,
+        )
+    users, next_cursor = page
+
+    return WebsocketUserResponse(action=WebSocketActions.GET_USERS, data={"users": users}, next_cursor=next_cursor)
 
 
-async def send_message(data: MessageCreate, db: AsyncSession, token: str):
+async def send_message(data: MessageCreate, db: AsyncSession, token: str, websocket: Optional[WebSocket] = None):
     await check_blacklisted_token(action=WebSocketActions.SEND_MESSAGE, db=db, token=token)
-    sender = await get_current_user_via_websocket(token=token, db=db, action=WebSocketActions.SEND_MESSAGE)
+    sender = await get_current_user_via_websocket(
+        token=token, db=db, action=WebSocketActions.SEND_MESSAGE, websocket=websocket
+    )
     if not sender:
         raise WebSocketValidationException(
             detail="Sender not found!",
@@ -174,60 +202,70 @@ async def send_message(data: MessageCreate, db: AsyncSession, token: str):
             detail="Invalid UUID format for chat_uuid!", action=WebSocketActions.SEND_MESSAGE
         )
 
-    chat_query = select(Chat).options(selectinload(Chat.participants)).filter(Chat.uuid == chat_uuid)
-    chat_result = await db.execute(chat_query)
-    chat = chat_result.scalars().first()
-    if not chat:
+    # Membership comes from memory, so the INSERT ... RETURNING below is the only round trip in the common case
+    participants = await get_chat_participants(chat_uuid, db)
+    if sender.uuid not in participants:
         raise WebSocketValidationException(
             detail="Chat not found!",
             action=WebSocketActions.SEND_MESSAGE,
         )
 
-    message = Message(
-        chat_uuid=chat.uuid,
-        sender_uuid=sender.uuid,
+    if message_writer.enabled:
+        # Server-assigned identity, the row is written by the write-behind flusher after the fan-out
+        message_id, message_uuid, sent_at = None, uuid4(), datetime.now(timezone.utc).replace(tzinfo=None)
+    else:
+        message_id, message_uuid, sent_at = await chat_crud.create_message(chat_uuid, sender.uuid, data.content, db)
+
+    message_response = MessageResponse(
+        uuid=str(message_uuid),
+        chat_uuid=str(chat_uuid),
+        sender_uuid=str(sender.uuid),
+        sender_nickname=sender.nickname,
         content=data.content,
+        sent_at=sent_at.isoformat(),
     )
-    db.add(message)
-    await db.commit()
-    await db.refresh(message)
-
-    other_participant = next(participant for participant in chat.participants if participant.id != sender.id)
-    other_participant_websocket = next(
-        (ws for uuid, ws in manager.socket_to_user.items() if uuid == other_participant.uuid), None
-    )
-    print(f"{manager.socket_to_user.items()=}")
-    if other_participant_websocket:
-        print(f"DONE: {other_participant_websocket=}")
-        await manager.send_json(
+    new_message_event = {
+        "action": WebSocketActions.NEW_MESSAGE_RECEIVED,
+        "data": {
+            "id": message_id,
+            "uuid": str(message_uuid),
+            "chat_uuid": str(chat_uuid),
+            "sender_uuid": str(sender.uuid),
+            "sender_nickname": sender.nickname,
+            "content": data.content,
+            "sent_at": sent_at.isoformat(),
+        },
+    }
+    # Also updates the participants' cached conversation lists, the sender's included, on whichever process holds them
+    for participant_uuid in participants:
+        await manager.send_to_user(participant_uuid, new_message_event, exclude=websocket)
+
+    if message_writer.enabled:
+        # Return the connection (if a cache miss checked one out) to the pool before waiting for the flusher
+        await db.commit()
+        await message_writer.append(
             {
-                "action": WebSocketActions.NEW_MESSAGE_RECEIVED,
-                "data": {
-                    "id": message.id,
-                    "chat_uuid": str(chat.uuid),
-                    "sender_uuid": str(sender.uuid),
-                    "content": message.content,
-                    "sent_at": message.sent_at.isoformat(),
-                },
-            },
-            other_participant_websocket,
+                "uuid": message_uuid,
+                "chat_uuid": chat_uuid,
+                "sender_uuid": sender.uuid,
+                "content": data.content,
+                "sent_at": sent_at,
+            }
         )
 
-    return WebsocketMessageCreateResponse(
-        action=WebSocketActions.SEND_MESSAGE,
-        data=MessageResponse(
-            chat_uuid=str(message.chat_uuid),
-            sender_uuid=str(sender.uuid),
-            sender_nickname=sender.nickname,
-            content=message.content,
-            sent_at=message.sent_at.isoformat(),
-        ),
-    )
+    return WebsocketMessageCreateResponse(action=WebSocketActions.SEND_MESSAGE, data=message_response)
 
 
-async def create_chat(data: ChatCreate, db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def create_chat(
+    data: ChatCreate,
+    db: AsyncSession = Depends(get_db),
+    token: str = Depends(oauth2_scheme),
+    websocket: Optional[WebSocket] = None,
+):
     await check_blacklisted_token(action=WebSocketActions.CREATE_CHAT, db=db, token=token)
-    creator = await get_current_user_via_websocket(token=token, db=db, action=WebSocketActions.CREATE_CHAT)
+    creator = await get_current_user_via_websocket(
+        token=token, db=db, action=WebSocketActions.CREATE_CHAT, websocket=websocket
+    )
     if not creator:
         raise WebSocketValidationException(
             detail="Chat creator not found!",
@@ -240,47 +278,101 @@ async def create_chat(data: ChatCreate, db: AsyncSession = Depends(get_db), toke
             detail="Chat participant not found!",
             action=WebSocketActions.CREATE_CHAT,
         )
-
-    existing_chat_query = (
-        select(Chat)
-        .join(Chat.participants)
-        .where(
-            Chat.is_group == False,  # noqa
-            Chat.participants.any(User.id == creator.id),
-            Chat.participants.any(User.id == participant.id),
-        )
-    )
-    existing_chat_result = await db.execute(existing_chat_query)
-    existing_chat = existing_chat_result.scalars().first()
-
-    if existing_chat:
+    if participant.id == creator.id:
         raise WebSocketValidationException(
-            detail="A chat already exists between these participants!",
+            detail="You can't create a chat with yourself!",
             action=WebSocketActions.CREATE_CHAT,
+            field="participant_email",
         )
 
+    # Insert-or-fetch: the unique pair key settles concurrent CREATE_CHAT calls for the same pair
+    direct_pair_key = chat_crud.get_direct_pair_key(creator.uuid, participant.uuid)
     chat = Chat(
         is_group=False,
+        direct_pair_key=direct_pair_key,
     )
-    chat.participants.append(creator)
+    chat.participants.append(await db.get(User, creator.id))
     chat.participants.append(participant)
     db.add(chat)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        if await chat_crud.get_direct_chat(direct_pair_key, db) is None:
+            raise
+        raise WebSocketValidationException(
+            detail="A chat already exists between these participants!",
+            action=WebSocketActions.CREATE_CHAT,
+        )
     await db.refresh(chat)
+    chat_membership.put(chat.uuid, (creator.uuid, participant.uuid))
+
+    chat_response = ChatListResponse(
+        uuid=str(chat.uuid),
+        participants=[str(creator.uuid), str(participant.uuid)],
+        created_at=chat.created_at.isoformat(),
+        display_name=participant.nickname,
+        last_activity_at=chat.created_at.isoformat(),
+    )
+    await manager.send_to_user(
+        creator.uuid,
+        {"action": WebSocketActions.CHAT_CREATED, "data": chat_response.model_dump(mode="json")},
+        exclude=websocket,
+    )
+    await manager.send_to_user(
+        participant.uuid,
+        {
+            "action": WebSocketActions.CHAT_CREATED,
+            "data": chat_response.model_copy(update={"display_name": creator.nickname}).model_dump(mode="json"),
+        },
+        exclude=websocket,
+    )
 
-    return WebsocketChatCreateResponse(
-        action=WebSocketActions.CREATE_CHAT,
-        data=ChatListResponse(
-            uuid=str(chat.uuid),
-            participants=[str(creator.uuid), str(participant.uuid)],
-            created_at=chat.created_at.isoformat(),
-            display_name=participant.nickname,
-        ),
+    return WebsocketChatCreateResponse(action=WebSocketActions.CREATE_CHAT, data=chat_response)
+
+
+async def get_chat_messages(
+    chat_messages_data: GetChatMessages, db: AsyncSession, token: str, websocket: Optional[WebSocket] = None
+):
+    await check_blacklisted_token(action=WebSocketActions.GET_CHAT_MESSAGES, db=db, token=token)
+    try:
+        chat_uuid = UUID(chat_messages_data.chat_uuid)
+    except ValueError:
+        raise WebSocketValidationException(
+            detail="Invalid UUID format for chat_uuid!", action=WebSocketActions.GET_CHAT_MESSAGES
+        )
+
+    page = await chat_crud.get_chat_messages(
+        chat_uuid=chat_uuid,
+        db=db,
+        limit=chat_messages_data.limit,
+        before=chat_messages_data.before,
+        after=chat_messages_data.after,
     )
+    if page is None:
+        raise WebSocketValidationException(
+            detail="Cursor message not found in this chat!",
+            action=WebSocketActions.GET_CHAT_MESSAGES,
+            field="after" if chat_messages_data.after else "before",
+        )
+    chat_messages, next_cursor = page
 
+    # Reading the newest page of a chat marks it as read
+    if chat_messages and not chat_messages_data.before and not chat_messages_data.after:
+        await mark_chat_read(chat_messages_data.chat_uuid, chat_messages[-1].sent_at, db, token, websocket)
 
-async def get_chat_messages(chat_messages_data: GetChatMessages, db: AsyncSession, token: str):
-    await check_blacklisted_token(action=WebSocketActions.CREATE_CHAT, db=db, token=token)
-    chat_messages = await chat_crud.get_chat_messages(chat_uuid=chat_messages_data.chat_uuid, db=db)
+    return WebsocketMessagesResponse(
+        action=WebSocketActions.GET_CHAT_MESSAGES, data=chat_messages, next_cursor=next_cursor
+    )
 
-    return WebsocketMessagesResponse(action=WebSocketActions.GET_CHAT_MESSAGES, data=chat_messages)
+
+async def mark_chat_read(chat_uuid: str, read_at: str, db: AsyncSession, token: str, websocket: Optional[WebSocket]):
+    user = await get_current_user_via_websocket(
+        token=token, db=db, action=WebSocketActions.GET_CHAT_MESSAGES, websocket=websocket
+    )
+    if not user or not conversation_cache.has_unread(user.uuid, chat_uuid):
+        return
+    await chat_crud.mark_chat_read(user.uuid, UUID(chat_uuid), datetime.fromisoformat(read_at), db)
+    await manager.send_to_user(
+        user.uuid, {"action": WebSocketActions.CHAT_READ, "data": {"chat_uuid": chat_uuid}}, exclude=websocket
+    )
@@ -2,30 +2,36 @@ import base64
 import os
 from datetime import UTC, datetime, timedelta
 from secrets import token_urlsafe
+from typing import Optional
 
 import jwt
 from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from fastapi import WebSocket
 from fastapi.security import OAuth2PasswordBearer
 from jwt import DecodeError, ExpiredSignatureError, InvalidTokenError, PyJWTError
 from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 
+from api.blacklist import token_blacklist
 from api.crud.user import get_user_by_email
 from api.exceptions import WebSocketValidationException
 from api.models.token import BlacklistedToken
+from managers import Principal, manager
 from utils.config import (
     ACCESS_TOKEN_EXPIRATION_TIME,
     ENCRYPTION_ALGORITHM,
     IV_LENGTH,
     JWT_AES_KEY,
     JWT_SECRET,
+    PASSWORD_HASHING_WORKERS,
     TAG_LENGTH,
 )
+from utils.utils import BoundedExecutor
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hashing_executor = BoundedExecutor(max_workers=PASSWORD_HASHING_WORKERS, name="password-hashing")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
@@ -65,10 +71,18 @@ def verify_token(token: str):
         raise PyJWTError("Token is invalid!")
 
 
-async def get_current_user_via_websocket(token: str, db: AsyncSession, action: str):
+async def get_current_user_via_websocket(
+    token: str, db: AsyncSession, action: str, websocket: Optional[WebSocket] = None
+) -> Principal:
     if token is None:
         raise WebSocketValidationException(detail="Token is missing", action=action)
 
+    # Sockets authenticated with this token skip JWT verification and the user lookup until the token expires
+    if websocket is not None:
+        principal = manager.get_principal(websocket, token)
+        if principal is not None:
+            return principal
+
     try:
         email = verify_token(token)
     except PyJWTError:
@@ -78,7 +92,24 @@ async def get_current_user_via_websocket(token: str, db: AsyncSession, action: s
     if not user:
         raise WebSocketValidationException(detail="User not found", action=action)
 
-    return user
+    principal = Principal.from_user(user)
+    if websocket is not None:
+        await bind_principal(websocket, principal, token)
+    return principal
+
+
+async def bind_principal(websocket: WebSocket, principal: Principal, token: str):
+    await manager.bind_user(websocket, principal, token, get_unverified_claims(token).get("exp", 0))
+
+
+def decrypt_connection_token(websocket: WebSocket, encrypted_token: str) -> Optional[str]:
+    if not encrypted_token:
+        return None
+    token = manager.get_decrypted_token(websocket, encrypted_token)
+    if token is None:
+        token = decrypt_jwt(encrypted_token)
+        manager.remember_decrypted_token(websocket, encrypted_token, token)
+    return token
 
 
 def verify_password(plain_password, hashed_password):
@@ -91,21 +122,40 @@ def get_password_hash(password):
 
 async def verify_user(db: AsyncSession, email: str, password: str):
     user = await get_user_by_email(db, email=email)
-    if user and verify_password(password, user.hashed_password):
+    # Return the connection to the pool while the hash is verified, logins queued for a hashing thread must not pin it
+    await db.commit()
+    if user and await password_hashing_executor.run(verify_password, password, user.hashed_password):
         return user
     return None
 
 
+def get_unverified_claims(token: str) -> dict:
+    # Signature is checked separately by `verify_token`, only `jti` and `exp` are needed here
+    try:
+        return jwt.decode(token, options={"verify_signature": False})
+    except PyJWTError:
+        return {}
+
+
 async def blacklist_token(db: AsyncSession, token: str):
-    blacklisted_token = BlacklistedToken(token=token)
+    claims = get_unverified_claims(token)
+    jti, exp = claims.get("jti"), claims.get("exp")
+    blacklisted_token = BlacklistedToken(
+        token=token,
+        jti=jti,
+        expires_at=datetime.fromtimestamp(exp, UTC).replace(tzinfo=None) if exp else None,
+    )
     db.add(blacklisted_token)
     await db.commit()
+    if jti:
+        token_blacklist.add(jti, exp)
 
 
 async def is_token_blacklisted(db: AsyncSession, token: str = "") -> bool:
-    query = select(BlacklistedToken).where(BlacklistedToken.token == token)
-    result = await db.execute(query)
-    return result.scalars().first() is not None
+    jti = get_unverified_claims(token).get("jti") if token else None
+    if not jti:
+        return False
+    return jti in token_blacklist
 
 
 def encrypt_jwt(jwt_token):
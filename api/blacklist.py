@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from api.models.token import BlacklistedToken
+from engine import session_scope
+from utils import config
+from utils.logging_config import logger
+
+
+class BloomFilter:
+    """Probabilistic set: `in` never gives false negatives, and false positives at roughly `error_rate`"""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: k positions derived from two 64-bit halves of a single digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class TokenBlacklistCache:
+    """
+    Process-local copy of the token blacklist keyed by JWT `jti`.
+    Entries are dropped once their token expires, and other workers' revocations are picked up by `sync`.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.error_rate = error_rate
+        self.entries: Dict[str, float] = {}
+        self.bloom = BloomFilter(capacity, error_rate)
+        # Start of the previous sync, None until the first full load
+        self.last_synced_at: Optional[datetime] = None
+
+    def add(self, jti: str, expires_at: Optional[float]) -> None:
+        if expires_at is not None and expires_at <= time.time():
+            return
+        self.entries[jti] = expires_at if expires_at is not None else math.inf
+        self.bloom.add(jti)
+        if len(self.entries) > self.bloom.capacity:
+            self._rebuild(self.bloom.capacity * 2)
+
+    def __contains__(self, jti: str) -> bool:
+        # Common case: the token was never revoked and the bloom filter answers without a dict lookup
+        if jti not in self.bloom:
+            return False
+        expires_at = self.entries.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    def purge_expired(self) -> None:
+        now = time.time()
+        expired = [jti for jti, expires_at in self.entries.items() if expires_at <= now]
+        for jti in expired:
+            del self.entries[jti]
+        if expired:
+            # Bloom filters cannot forget items, so expired ones are dropped by rebuilding
+            self._rebuild(self.bloom.capacity)
+
+    def _rebuild(self, capacity: int) -> None:
+        self.bloom = BloomFilter(capacity, self.error_rate)
+        for jti in self.entries:
+            self.bloom.add(jti)
+
+    async def sync(self, db: AsyncSession) -> None:
+        """
+        Load the blacklist rows added since the previous sync. Rows are stamped before their transaction commits,
+        so a row can become visible after later ones were synced: the last TOKEN_BLACKLIST_SYNC_OVERLAP seconds
+        are scanned again and already known `jti`s skipped.
+        """
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        query = select(BlacklistedToken.jti, BlacklistedToken.expires_at).where(
+            BlacklistedToken.jti.is_not(None),
+            or_(BlacklistedToken.expires_at.is_(None), BlacklistedToken.expires_at > now),
+        )
+        if self.last_synced_at is not None:
+            query = query.where(
+                BlacklistedToken.blacklisted_at
+                >= self.last_synced_at - timedelta(seconds=config.TOKEN_BLACKLIST_SYNC_OVERLAP)
+            )
+        result = await db.execute(query)
+        for jti, expires_at in result.all():
+            if jti not in self.entries:
+                self.add(jti, expires_at.replace(tzinfo=timezone.utc).timestamp() if expires_at else None)
+        self.last_synced_at = now
+        self.purge_expired()
+
+
+token_blacklist = TokenBlacklistCache(
+    capacity=config.TOKEN_BLACKLIST_BLOOM_CAPACITY,
+    error_rate=config.TOKEN_BLACKLIST_BLOOM_ERROR_RATE,
+)
+
+
+async def sync_token_blacklist_periodically():
+    while True:
+        await asyncio.sleep(config.TOKEN_BLACKLIST_SYNC_INTERVAL)
+        try:
+            async with session_scope() as db:
+                await token_blacklist.sync(db)
+        except Exception as exc:
+            logger.error(f"Token blacklist sync failed: {exc}")
@@ -0,0 +1,145 @@
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+
+from api.schemas.chat import ChatListResponse
+from api.schemas.message import MessageResponse
+from managers import manager
+from utils import config
+from utils.enums import WebSocketActions
+
+
+@dataclass
+class ConversationList:
+    """Conversation list of one user, every change bumps `version` and is recorded per chat"""
+
+    # Version tokens of another list instance (e.g. before a reload) are not comparable
+    epoch: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    version: int = 0
+    chats: Dict[str, ChatListResponse] = field(default_factory=dict)
+    chat_versions: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def token(self) -> str:
+        return f"{self.epoch}.{self.version}"
+
+    def put(self, chat: ChatListResponse) -> None:
+        self.version += 1
+        self.chats[chat.uuid] = chat
+        self.chat_versions[chat.uuid] = self.version
+
+    def changed_since(self, token: str) -> Optional[list[ChatListResponse]]:
+        """Chats changed after the version token, None when the token does not belong to this list"""
+        epoch, _, version = token.partition(".")
+        if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+            return None
+        return self.by_activity(
+            chat for chat_uuid, chat in self.chats.items() if self.chat_versions[chat_uuid] > int(version)
+        )
+
+    def all(self) -> list[ChatListResponse]:
+        return self.by_activity(self.chats.values())
+
+    @staticmethod
+    def by_activity(chats: Iterable[ChatListResponse]) -> list[ChatListResponse]:
+        return sorted(chats, key=lambda chat: chat.last_activity_at, reverse=True)
+
+
+class ConversationCache:
+    """
+    Per-user conversation lists GET_CHATS is served from. A list is loaded from the database on first use, then
+    kept up to date by the NEW_MESSAGE_RECEIVED, CHAT_CREATED and CHAT_READ events delivered to this process, which
+    every participant (the user making the change included) is sent, whichever process holds them.
+    It is dropped once the user has no socket here, since the user's events stop reaching this process then.
+    """
+
+    def __init__(self, max_users: int) -> None:
+        self.max_users = max_users
+        self.lists: OrderedDict[uuid.UUID, ConversationList] = OrderedDict()
+        # Users whose list is being loaded, and whether it changed meanwhile
+        self.loading: Dict[uuid.UUID, bool] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_uuid: uuid.UUID) -> Optional[ConversationList]:
+        conversations = self.lists.get(user_uuid)
+        if conversations is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.lists.move_to_end(user_uuid)
+        return conversations
+
+    def begin_load(self, user_uuid: uuid.UUID) -> None:
+        self.loading[user_uuid] = False
+
+    def finish_load(self, user_uuid: uuid.UUID, chats: list[ChatListResponse]) -> ConversationList:
+        conversations = ConversationList()
+        for chat in reversed(chats):
+            conversations.put(chat)
+        # A list that changed while it was being read from the database may already be stale, so it is not kept
+        if not self.loading.pop(user_uuid, True):
+            self.lists[user_uuid] = conversations
+            while len(self.lists) > self.max_users:
+                self.lists.popitem(last=False)
+        return conversations
+
+    def add_chat(self, user_uuid: uuid.UUID, chat: ChatListResponse) -> None:
+        self._touch(user_uuid)
+        conversations = self.lists.get(user_uuid)
+        if conversations is not None:
+            conversations.put(chat)
+
+    def add_message(self, user_uuid: uuid.UUID, message: MessageResponse) -> None:
+        self._touch(user_uuid)
+        conversations = self.lists.get(user_uuid)
+        if conversations is None:
+            return
+        chat = conversations.chats.get(message.chat_uuid)
+        if chat is None:
+            # Chat created through another process, the list is reloaded on the next GET_CHATS
+            self.discard(user_uuid)
+            return
+        unread_count = chat.unread_count + (message.sender_uuid != str(user_uuid))
+        conversations.put(
+            chat.model_copy(
+                update={"last_message": message, "unread_count": unread_count, "last_activity_at": message.sent_at}
+            )
+        )
+
+    def mark_read(self, user_uuid: uuid.UUID, chat_uuid: str) -> None:
+        self._touch(user_uuid)
+        conversations = self.lists.get(user_uuid)
+        chat = conversations.chats.get(chat_uuid) if conversations else None
+        if chat is not None and chat.unread_count:
+            conversations.put(chat.model_copy(update={"unread_count": 0}))
+
+    def has_unread(self, user_uuid: uuid.UUID, chat_uuid: str) -> bool:
+        """Whether the chat may have unread messages for the user, True when the list is not cached"""
+        conversations = self.lists.get(user_uuid)
+        if conversations is None or chat_uuid not in conversations.chats:
+            return True
+        return conversations.chats[chat_uuid].unread_count > 0
+
+    def discard(self, user_uuid: uuid.UUID) -> None:
+        self._touch(user_uuid)
+        self.lists.pop(user_uuid, None)
+
+    def handle_event(self, user_uuid: uuid.UUID, data: dict) -> None:
+        action = data.get("action")
+        if action == WebSocketActions.NEW_MESSAGE_RECEIVED:
+            self.add_message(user_uuid, MessageResponse(**data["data"]))
+        elif action == WebSocketActions.CHAT_CREATED:
+            self.add_chat(user_uuid, ChatListResponse(**data["data"]))
+        elif action == WebSocketActions.CHAT_READ:
+            self.mark_read(user_uuid, data["data"]["chat_uuid"])
+
+    def _touch(self, user_uuid: uuid.UUID) -> None:
+        if user_uuid in self.loading:
+            self.loading[user_uuid] = True
+
+
+conversation_cache = ConversationCache(max_users=config.CONVERSATION_CACHE_MAX_USERS)
+manager.event_listeners.append(conversation_cache.handle_event)
+manager.release_listeners.append(conversation_cache.discard)
@@ -1,50 +1,223 @@
+from datetime import datetime, timezone
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import func, insert, or_, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 from api.models import Chat, Message, User
+from api.models.chat import user_chat_association
 from api.schemas.chat import ChatListResponse
 from api.schemas.message import MessageResponse
 
 
-async def get_chats_for_user(user_uuid: int, db: AsyncSession) -> list[ChatListResponse]:
+def get_direct_pair_key(first_user_uuid: UUID, second_user_uuid: UUID) -> str:
+    return ":".join(sorted((str(first_user_uuid), str(second_user_uuid))))
+
+
+async def get_direct_chat(direct_pair_key: str, db: AsyncSession) -> Optional[Chat]:
+    result = await db.execute(select(Chat).where(Chat.direct_pair_key == direct_pair_key))
+    return result.scalars().first()
+
+
+async def get_chat_participant_uuids(chat_uuid: UUID, db: AsyncSession) -> list[UUID]:
+    query = (
+        select(User.uuid)
+        .join(user_chat_association, user_chat_association.c.user_id == User.id)
+        .join(Chat, Chat.id == user_chat_association.c.chat_id)
+        .where(Chat.uuid == chat_uuid)
+    )
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+
+async def create_message(
+    chat_uuid: UUID, sender_uuid: UUID, content: str, db: AsyncSession
+) -> tuple[int, UUID, datetime]:
+    """Inserts the message and returns its id, uuid and sent time in the same round trip"""
+    query = (
+        insert(Message)
+        .values(chat_uuid=chat_uuid, sender_uuid=sender_uuid, content=content)
+        .returning(Message.id, Message.uuid, Message.sent_at)
+    )
+    result = await db.execute(query)
+    await db.commit()
+    return result.one()
+
+
+async def get_chats_for_user(user_uuid: UUID, db: AsyncSession) -> list[ChatListResponse]:
+    """Chats of the user with their last message and unread count, most recently active first"""
     query = (
         select(Chat).options(selectinload(Chat.participants)).join(Chat.participants).filter(User.uuid == user_uuid)
     )
     result = await db.execute(query)
     chats = result.scalars().all()
+    last_messages = await get_last_messages([chat.uuid for chat in chats], db)
+    unread_counts = await get_unread_counts(user_uuid, db)
 
     chat_responses = []
     for chat in chats:
         other_participant = next(participant for participant in chat.participants if participant.uuid != user_uuid)
+        last_message = last_messages.get(str(chat.uuid))
+        created_at = chat.created_at.isoformat()
         chat_responses.append(
             ChatListResponse(
                 uuid=str(chat.uuid),
                 participants=[str(p.uuid) for p in chat.participants],
-                created_at=chat.created_at.isoformat(),
+                created_at=created_at,
                 display_name=other_participant.nickname,
+                last_message=last_message,
+                unread_count=unread_counts.get(chat.uuid, 0),
+                last_activity_at=last_message.sent_at if last_message else created_at,
             )
         )
 
+    chat_responses.sort(key=lambda chat: chat.last_activity_at, reverse=True)
     return chat_responses
 
 
-async def get_chat_messages(chat_uuid: str, db: AsyncSession):
-    chat = await db.execute(
-        select(Chat).options(selectinload(Chat.messages).selectinload(Message.sender)).where(Chat.uuid == chat_uuid)
+async def get_last_messages(chat_uuids: list[UUID], db: AsyncSession) -> dict[str, MessageResponse]:
+    if not chat_uuids:
+        return {}
+
+    ranked = (
+        select(
+            Message.uuid,
+            Message.chat_uuid,
+            Message.sender_uuid,
+            Message.content,
+            Message.sent_at,
+            func.row_number()
+            .over(partition_by=Message.chat_uuid, order_by=(Message.sent_at.desc(), Message.id.desc()))
+            .label("position"),
+        )
+        .where(Message.chat_uuid.in_(chat_uuids))
+        .subquery()
     )
-    chat = chat.scalars().first()
-    if not chat:
-        return None
+    query = (
+        select(
+            ranked.c.uuid, ranked.c.chat_uuid, ranked.c.sender_uuid, User.nickname, ranked.c.content, ranked.c.sent_at
+        )
+        .join(User, User.uuid == ranked.c.sender_uuid)
+        .where(ranked.c.position == 1)
+    )
+    result = await db.execute(query)
+    return {
+        str(chat_uuid): MessageResponse(
+            uuid=str(message_uuid),
+            chat_uuid=str(chat_uuid),
+            sender_uuid=str(sender_uuid),
+            sender_nickname=sender_nickname,
+            content=content,
+            sent_at=sent_at.isoformat(),
+        )
+        for message_uuid, chat_uuid, sender_uuid, sender_nickname, content, sent_at in result.all()
+    }
+
+
+async def get_unread_counts(user_uuid: UUID, db: AsyncSession) -> dict[UUID, int]:
+    """Number of messages of other participants sent after the user last read each chat"""
+    query = (
+        select(Message.chat_uuid, func.count(Message.id))
+        .join(Chat, Chat.uuid == Message.chat_uuid)
+        .join(user_chat_association, user_chat_association.c.chat_id == Chat.id)
+        .join(User, User.id == user_chat_association.c.user_id)
+        .where(
+            User.uuid == user_uuid,
+            Message.sender_uuid != user_uuid,
+            or_(
+                user_chat_association.c.last_read_at.is_(None),
+                Message.sent_at > user_chat_association.c.last_read_at,
+            ),
+        )
+        .group_by(Message.chat_uuid)
+    )
+    result = await db.execute(query)
+    return dict(result.all())
+
+
+async def mark_chat_read(user_uuid: UUID, chat_uuid: UUID, read_at: datetime, db: AsyncSession) -> None:
+    query = (
+        update(user_chat_association)
+        .where(
+            user_chat_association.c.user_id == select(User.id).where(User.uuid == user_uuid).scalar_subquery(),
+            user_chat_association.c.chat_id == select(Chat.id).where(Chat.uuid == chat_uuid).scalar_subquery(),
+            or_(user_chat_association.c.last_read_at.is_(None), user_chat_association.c.last_read_at < read_at),
+        )
+        .values(last_read_at=read_at)
+    )
+    await db.execute(query)
+    await db.commit()
+
+
+async def _resolve_cursor(cursor: str, chat_uuid: UUID, db: AsyncSession) -> Optional[tuple[datetime, Optional[int]]]:
+    """Position of the cursor, None when it is a message uuid of no message in the chat"""
+    try:
+        message_uuid = UUID(cursor)
+    except ValueError:
+        sent_at = datetime.fromisoformat(cursor)
+        if sent_at.tzinfo is not None:
+            sent_at = sent_at.astimezone(timezone.utc).replace(tzinfo=None)
+        return sent_at, None
+
+    result = await db.execute(
+        select(Message.sent_at, Message.id).where(Message.uuid == message_uuid, Message.chat_uuid == chat_uuid)
+    )
+    return result.first()
+
+
+async def get_chat_messages(
+    chat_uuid: UUID,
+    db: AsyncSession,
+    limit: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> Optional[tuple[list[MessageResponse], Optional[str]]]:
+    """Keyset-paginated page of chat messages in chronological order, plus the cursor of the next page"""
+    query = (
+        select(Message.uuid, Message.content, Message.sent_at, User.uuid, User.nickname)
+        .join(User, Message.sender_uuid == User.uuid)
+        .where(Message.chat_uuid == chat_uuid)
+    )
+    message_key = tuple_(Message.sent_at, Message.id)
+
+    cursor = after or before
+    if cursor:
+        position = await _resolve_cursor(cursor, chat_uuid, db)
+        if position is None:
+            return None
+        sent_at, message_id = position
+        if after:
+            query = query.where(message_key > tuple_(sent_at, message_id) if message_id else Message.sent_at > sent_at)
+        else:
+            query = query.where(message_key < tuple_(sent_at, message_id) if message_id else Message.sent_at < sent_at)
+
+    if after:
+        query = query.order_by(Message.sent_at.asc(), Message.id.asc())
+    else:
+        query = query.order_by(Message.sent_at.desc(), Message.id.desc())
+
+    result = await db.execute(query.limit(limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not after:
+        rows.reverse()
+
+    next_cursor = None
+    if has_more:
+        next_cursor = str(rows[-1][0] if after else rows[0][0])
 
-    messages = chat.messages
     return [
         MessageResponse(
-            chat_uuid=str(chat.uuid),
-            sender_uuid=str(message.sender.uuid),
-            sender_nickname=message.sender.nickname,
-            content=message.content,
-            sent_at=message.sent_at.isoformat(),
+            uuid=str(message_uuid),
+            chat_uuid=str(chat_uuid),
+            sender_uuid=str(sender_uuid),
+            sender_nickname=sender_nickname,
+            content=content,
+            sent_at=sent_at.isoformat(),
         )
-        for message in messages
-    ]
+        for message_uuid, content, sent_at, sender_uuid, sender_nickname in rows
+    ], next_cursor
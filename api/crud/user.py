@@ -1,10 +1,12 @@
 from typing import Optional
+from uuid import UUID
 
+from sqlalchemy import func, or_, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import aliased
 
-from api.models import Chat
+from api.models.chat import user_chat_association
 from api.models.user import User
 from api.schemas.user import UserListResponse
 
@@ -21,31 +23,55 @@ async def get_user_by_uuid(db: AsyncSession, uuid: str) -> Optional[User]:
     return result.scalars().first()
 
 
-async def get_users_list(request_user_uuid: User, db: AsyncSession):
-    users = await db.execute(select(User).filter(User.is_active == True, User.uuid != request_user_uuid))  # noqa
-    users = users.scalars().all()
-
-    chats_query = (
-        select(Chat)
-        .options(joinedload(Chat.participants))
-        .join(Chat.participants)
-        .filter(User.uuid == request_user_uuid)
+async def get_users_list(
+    request_user_id: int,
+    db: AsyncSession,
+    limit: int,
+    search: Optional[str] = None,
+    after: Optional[str] = None,
+) -> Optional[tuple[list[UserListResponse], Optional[str]]]:
+    """
+    Keyset-paginated page of active users the requester has no chat with yet, ordered by nickname,
+    plus the cursor of the next page. None for an unknown cursor.
+    """
+    requester_membership = aliased(user_chat_association)
+    candidate_membership = aliased(user_chat_association)
+    # Anti-join: users sharing any chat with the requester
+    shares_chat = (
+        select(candidate_membership.c.user_id)
+        .join(requester_membership, requester_membership.c.chat_id == candidate_membership.c.chat_id)
+        .where(candidate_membership.c.user_id == User.id, requester_membership.c.user_id == request_user_id)
+        .exists()
+    )
+    nickname_key = func.lower(User.nickname)
+    query = select(User.uuid, User.email, User.nickname).where(
+        User.is_active == True, User.id != request_user_id, ~shares_chat  # noqa
     )
-    chats_result = await db.execute(chats_query)
-    chats = chats_result.unique().scalars().all()
 
-    # Collect UUIDs of users who are participants in any chat with the requesting user
-    excluded_user_uuids = {
-        participant.uuid
-        for chat in chats
-        for participant in chat.participants
-        if participant.uuid != request_user_uuid
-    }
+    if search:
+        search = search.lower()
+        query = query.where(
+            or_(
+                nickname_key.startswith(search, autoescape=True),
+                func.lower(User.email).startswith(search, autoescape=True),
+            )
+        )
+
+    if after:
+        result = await db.execute(select(nickname_key, User.id).where(User.uuid == UUID(after)))
+        position = result.first()
+        if position is None:
+            return None
+        query = query.where(tuple_(nickname_key, User.id) > tuple_(*position))
 
-    # Filter out users who are in the excluded_user_uuids set
-    filtered_users = [user for user in users if user.uuid not in excluded_user_uuids]
+    result = await db.execute(query.order_by(nickname_key, User.id).limit(limit + 1))
+    rows = result.all()
+    next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
 
-    return [UserListResponse(email=user.email, nickname=user.nickname, uuid=str(user.uuid)) for user in filtered_users]
+    return [
+        UserListResponse(email=email, nickname=nickname, uuid=str(user_uuid))
+        for user_uuid, email, nickname in rows[:limit]
+    ], next_cursor
 
 
 async def create_user(db: AsyncSession, email: str, nickname: str, hashed_password: str):
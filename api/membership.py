@@ -0,0 +1,60 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.crud import chat as chat_crud
+from utils import config
+
+
+class ChatMembershipCache:
+    """
+    chat uuid -> participant uuids, so sending a message needs no chat lookup.
+    Entries expire after `ttl` seconds and the least recently used ones are evicted beyond `max_size`.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[uuid.UUID, tuple[frozenset[uuid.UUID], float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_uuid: uuid.UUID) -> Optional[frozenset[uuid.UUID]]:
+        entry = self.entries.get(chat_uuid)
+        if entry is None or entry[1] <= time.monotonic():
+            self.entries.pop(chat_uuid, None)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(chat_uuid)
+        return entry[0]
+
+    def put(self, chat_uuid: uuid.UUID, participant_uuids: Iterable[uuid.UUID]) -> frozenset[uuid.UUID]:
+        participants = frozenset(participant_uuids)
+        self.entries[chat_uuid] = (participants, time.monotonic() + self.ttl)
+        self.entries.move_to_end(chat_uuid)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return participants
+
+    def discard(self, chat_uuid: uuid.UUID) -> None:
+        self.entries.pop(chat_uuid, None)
+
+
+chat_membership = ChatMembershipCache(
+    max_size=config.CHAT_MEMBERSHIP_CACHE_SIZE,
+    ttl=config.CHAT_MEMBERSHIP_CACHE_TTL,
+)
+
+
+async def get_chat_participants(chat_uuid: uuid.UUID, db: AsyncSession) -> frozenset[uuid.UUID]:
+    """Participants of the chat, empty for an unknown chat (which is not cached, it may be created later)"""
+    participants = chat_membership.get(chat_uuid)
+    if participants is None:
+        participants = frozenset(await chat_crud.get_chat_participant_uuids(chat_uuid, db))
+        if participants:
+            chat_membership.put(chat_uuid, participants)
+    return participants
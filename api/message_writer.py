@@ -0,0 +1,155 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from api.models import Message
+from engine import session_scope
+from utils import config
+from utils.logging_config import logger
+
+
+@dataclass
+class PendingMessage:
+    row: dict
+    # Resolved once the row is committed, only with the "durable" acknowledgement
+    written: Optional[asyncio.Future] = None
+
+
+class MessageWriteBehind:
+    """
+    Optional write-behind buffer for chat messages. send_message delivers the message and hands the row over,
+    and a single flusher task writes the buffered rows with one multi-row INSERT per `batch_size` rows or every
+    `interval_ms`, whichever comes first. With the "durable" acknowledgement the sender still waits for the commit:
+    an idle flusher is woken right away, and rows arriving during an insert form the next batch (a group commit).
+    With "delivered" it only waits for the fan-out.
+    """
+
+    def __init__(self, enabled: bool, interval_ms: int, batch_size: int, max_pending: int, ack: str) -> None:
+        self.enabled = enabled
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.ack = ack
+        self.pending: deque[PendingMessage] = deque()
+        self.ready = asyncio.Event()
+        self.room = asyncio.Event()
+        self.room.set()
+        self.flusher: Optional[asyncio.Task] = None
+        self.stopping = False
+        # Waiting for rows, with the previous flush succeeded (a failing database is only retried every interval)
+        self.idle = False
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self.enabled and self.flusher is None:
+            # Fresh events, bound to the running loop
+            self.ready, self.room = asyncio.Event(), asyncio.Event()
+            self.room.set()
+            self.stopping = False
+            self.flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """Writes whatever is still buffered, the flusher is not cancelled so an in-flight batch is not lost"""
+        if self.flusher is None:
+            return
+        self.stopping = True
+        self.ready.set()
+        await self.flusher
+        self.flusher = None
+
+        if not await self._drain():
+            logger.error(f"Dropping {len(self.pending)} unwritten messages on shutdown")
+            self.failed += len(self.pending)
+            for message in self.pending:
+                if message.written is not None and not message.written.done():
+                    message.written.set_exception(RuntimeError("Message was not written"))
+            self.pending.clear()
+
+    async def append(self, row: dict) -> None:
+        # Backpressure: senders wait while the buffer is full, e.g. during a database outage
+        while len(self.pending) >= self.max_pending:
+            self.room.clear()
+            await self.room.wait()
+
+        message = PendingMessage(row)
+        if self.ack == "durable":
+            message.written = asyncio.get_running_loop().create_future()
+        self.pending.append(message)
+        if len(self.pending) >= self.batch_size or (message.written is not None and self.idle):
+            self.ready.set()
+        if message.written is not None:
+            await message.written
+
+    async def _flush_periodically(self) -> None:
+        self.idle = True
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.ready.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.ready.clear()
+            self.idle = False
+            self.idle = await self._drain()
+
+    async def _drain(self) -> bool:
+        while self.pending:
+            if not await self._flush_batch():
+                # The batch was put back, it is retried on the next tick
+                return False
+        return True
+
+    async def _flush_batch(self) -> bool:
+        batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+        try:
+            await self._insert([message.row for message in batch])
+        except IntegrityError:
+            # A single bad row must not block the rest of the batch
+            await self._insert_one_by_one(batch)
+            return True
+        except Exception as exc:
+            logger.error(f"Message write-behind flush failed, retrying: {exc}")
+            self.pending.extendleft(reversed(batch))
+            return False
+
+        self._acknowledge(batch)
+        return True
+
+    async def _insert_one_by_one(self, batch: list[PendingMessage]) -> None:
+        for message in batch:
+            try:
+                await self._insert([message.row])
+            except Exception as exc:
+                logger.error(f"Message {message.row.get('uuid')} could not be written: {exc}")
+                self.failed += 1
+                if message.written is not None and not message.written.done():
+                    message.written.set_exception(exc)
+            else:
+                self._acknowledge([message])
+
+    async def _insert(self, rows: list[dict]) -> None:
+        async with session_scope() as db:
+            await db.execute(insert(Message), rows)
+        self.batches += 1
+
+    def _acknowledge(self, batch: list[PendingMessage]) -> None:
+        self.written += len(batch)
+        for message in batch:
+            if message.written is not None and not message.written.done():
+                message.written.set_result(None)
+        if len(self.pending) < self.max_pending:
+            self.room.set()
+
+
+message_writer = MessageWriteBehind(
+    enabled=config.MESSAGE_WRITE_BEHIND,
+    interval_ms=config.MESSAGE_WRITE_BEHIND_INTERVAL_MS,
+    batch_size=config.MESSAGE_WRITE_BEHIND_BATCH_SIZE,
+    max_pending=config.MESSAGE_WRITE_BEHIND_MAX_PENDING,
+    ack=config.MESSAGE_WRITE_BEHIND_ACK,
+)
@@ -7,6 +7,7 @@ from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     Table,
@@ -21,6 +22,8 @@ user_chat_association = Table(
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
     Column("chat_id", Integer, ForeignKey("chats.id"), primary_key=True),
+    # Messages of other participants sent after it are unread for the user
+    Column("last_read_at", DateTime, nullable=True),
 )
 
 
@@ -31,6 +34,8 @@ class Chat(Base):
     uuid = Column(UUID(as_uuid=True), default=uuid.uuid4, unique=True, nullable=False, index=True)
     name = Column(String, nullable=True)  # For group chats
     is_group = Column(Boolean, default=False)  # For group chats
+    # Sorted "<uuid>:<uuid>" of the two participants of a direct chat, so a pair can only have one
+    direct_pair_key = Column(String(73), nullable=True, unique=True, index=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
 
     participants = relationship("User", secondary=user_chat_association, back_populates="chats")
@@ -42,6 +47,7 @@ class Chat(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (Index("ix_messages_chat_uuid_sent_at_id", "chat_uuid", "sent_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True, nullable=False)
     chat_uuid = Column(UUID(as_uuid=True), ForeignKey("chats.uuid"), nullable=False)
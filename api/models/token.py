@@ -10,4 +10,6 @@ class BlacklistedToken(Base):
 
     id = Column(Integer, primary_key=True, index=True, nullable=False)
     token = Column(String, nullable=False)
-    blacklisted_at = Column(DateTime, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+    jti = Column(String, nullable=True, index=True)
+    expires_at = Column(DateTime, nullable=True)
+    blacklisted_at = Column(DateTime, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None), index=True)
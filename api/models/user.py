@@ -1,6 +1,15 @@
 import uuid
 
-from sqlalchemy import UUID, Boolean, Column, Integer, String, UniqueConstraint
+from sqlalchemy import (
+    UUID,
+    Boolean,
+    Column,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    func,
+)
 from sqlalchemy.orm import relationship
 
 from api.models.chat import user_chat_association
@@ -38,3 +47,18 @@ class User(Base):
         if self.first_name and self.last_name:
             return f"{self.first_name} {self.last_name}"
         return "First name or last name are undefined"
+
+
+# GET_USERS: keyset pagination by nickname, and case-insensitive prefix search on nickname or email.
+# text_pattern_ops lets Postgres serve LIKE 'prefix%' from an index whatever the database collation is.
+Index("ix_users_lower_nickname_id", func.lower(User.nickname), User.id)
+Index(
+    "ix_users_lower_nickname_pattern",
+    func.lower(User.nickname).label("lower_nickname"),
+    postgresql_ops={"lower_nickname": "text_pattern_ops"},
+)
+Index(
+    "ix_users_lower_email_pattern",
+    func.lower(User.email).label("lower_email"),
+    postgresql_ops={"lower_email": "text_pattern_ops"},
+)
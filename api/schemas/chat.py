@@ -1,5 +1,8 @@
+from typing import Optional
+
 from pydantic import BaseModel, EmailStr
 
+from api.schemas.message import MessageResponse
 from api.schemas.ws import WebSocketResponseMessage
 
 
@@ -7,15 +10,27 @@ class ChatCreate(BaseModel):
     participant_email: EmailStr
 
 
+class GetChats(BaseModel):
+    # Version token of a previous GET_CHATS response, only the chats changed since then are returned
+    since: Optional[str] = None
+
+
 class ChatListResponse(BaseModel):
     uuid: str
     participants: list[str]
     created_at: str
     display_name: str
+    last_message: Optional[MessageResponse] = None
+    unread_count: int = 0
+    # Sent time of the last message, or the creation time of a chat without messages
+    last_activity_at: str
 
 
 class WebsocketChatResponse(WebSocketResponseMessage):
     data: dict[str, list[ChatListResponse]]
+    version: Optional[str] = None
+    # True when `data` only holds the chats changed since the requested version
+    incremental: bool = False
 
 
 class WebsocketChatCreateResponse(WebSocketResponseMessage):
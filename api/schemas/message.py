@@ -1,6 +1,11 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from pydantic import BaseModel, conint, field_validator, model_validator
 
 from api.schemas.ws import WebSocketResponseMessage
+from utils.config import CHAT_MESSAGES_MAX_PAGE_SIZE, CHAT_MESSAGES_PAGE_SIZE
 
 
 class MessageCreate(BaseModel):
@@ -10,9 +15,33 @@ class MessageCreate(BaseModel):
 
 class GetChatMessages(BaseModel):
     chat_uuid: str
+    # Cursors accept either a message uuid or an ISO-formatted `sent_at` timestamp
+    before: Optional[str] = None
+    after: Optional[str] = None
+    limit: conint(ge=1, le=CHAT_MESSAGES_MAX_PAGE_SIZE) = CHAT_MESSAGES_PAGE_SIZE
+
+    @field_validator("before", "after")
+    def validate_cursor(cls, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return value
+        try:
+            UUID(value)
+        except ValueError:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError("Cursor must be a message uuid or an ISO-formatted datetime.")
+        return value
+
+    @model_validator(mode="after")
+    def validate_single_cursor(self):
+        if self.before is not None and self.after is not None:
+            raise ValueError("Only one of 'before' and 'after' can be specified.")
+        return self
 
 
 class MessageResponse(BaseModel):
+    uuid: str
     chat_uuid: str
     sender_uuid: str
     sender_nickname: str
@@ -22,6 +51,7 @@ class MessageResponse(BaseModel):
 
 class WebsocketMessagesResponse(WebSocketResponseMessage):
     data: list[MessageResponse]
+    next_cursor: Optional[str] = None
 
 
 class WebsocketMessageCreateResponse(WebSocketResponseMessage):
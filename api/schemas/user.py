@@ -1,6 +1,10 @@
-from pydantic import BaseModel, constr, field_validator
+from typing import Optional
+from uuid import UUID
+
+from pydantic import BaseModel, conint, constr, field_validator
 
 from api.schemas.ws import WebSocketResponseMessage
+from utils.config import USERS_MAX_PAGE_SIZE, USERS_PAGE_SIZE
 
 
 class EmailPasswordValidation(BaseModel):
@@ -46,6 +50,23 @@ class MeSchema(BaseModel):
     user_uuid: str
 
 
+class GetUsers(BaseModel):
+    # Case-insensitive prefix of the nickname or the email
+    search: Optional[constr(strip_whitespace=True, max_length=255)] = None
+    # Uuid of the last user of the previous page
+    after: Optional[str] = None
+    limit: conint(ge=1, le=USERS_MAX_PAGE_SIZE) = USERS_PAGE_SIZE
+
+    @field_validator("after")
+    def validate_cursor(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            try:
+                UUID(value)
+            except ValueError:
+                raise ValueError("Cursor must be a user uuid.")
+        return value
+
+
 class UserListResponse(BaseModel):
     email: str
     nickname: str
@@ -54,3 +75,4 @@ class UserListResponse(BaseModel):
 
 class WebsocketUserResponse(WebSocketResponseMessage):
     data: dict[str, list[UserListResponse]]
+    next_cursor: Optional[str] = None
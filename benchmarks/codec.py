@@ -0,0 +1,127 @@
+"""
+WebSocket frame serialization: the legacy `.model_dump()` + `json.dumps` path vs the codecs in `utils.serialization`.
+
+Encodes a GET_CHAT_MESSAGES and a GET_CHATS response of `--items` entries each, and decodes an inbound
+SEND_MESSAGE frame, reporting the frame size of every codec. Codecs whose optional dependency is not installed
+are skipped.
+
+Usage: python -m benchmarks.codec [--items 50] [--iterations 20000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.schemas.chat import ChatListResponse, WebsocketChatResponse  # noqa: E402
+from api.schemas.message import MessageResponse, WebsocketMessagesResponse  # noqa: E402
+from utils.enums import WebSocketActions  # noqa: E402
+from utils.serialization import (  # noqa: E402
+    JsonCodec,
+    MsgpackCodec,
+    MsgspecCodec,
+    OrjsonCodec,
+    msgspec,
+    orjson,
+)
+
+
+def build_frames(items: int) -> dict:
+    sent_at = datetime.now().isoformat()
+    chat_uuid, sender_uuid = str(uuid.uuid4()), str(uuid.uuid4())
+    messages = WebsocketMessagesResponse(
+        action=WebSocketActions.GET_CHAT_MESSAGES,
+        data=[
+            MessageResponse(
+                uuid=str(uuid.uuid4()),
+                chat_uuid=chat_uuid,
+                sender_uuid=sender_uuid,
+                sender_nickname="sender",
+                content=f"Message number {number}, with some ünïcode 👋",
+                sent_at=sent_at,
+            )
+            for number in range(items)
+        ],
+        next_cursor=str(uuid.uuid4()),
+    )
+    chats = WebsocketChatResponse(
+        action=WebSocketActions.GET_CHATS,
+        data={
+            "chats": [
+                ChatListResponse(
+                    uuid=str(uuid.uuid4()),
+                    participants=[sender_uuid, str(uuid.uuid4())],
+                    created_at=sent_at,
+                    display_name=f"user {number}",
+                    last_activity_at=sent_at,
+                )
+                for number in range(items)
+            ]
+        },
+    )
+    return {"GET_CHAT_MESSAGES": messages, "GET_CHATS": chats}
+
+
+def get_codecs() -> dict:
+    codecs = {"json": JsonCodec()}
+    if orjson is not None:
+        codecs["orjson"] = OrjsonCodec()
+    if msgspec is not None:
+        codecs["msgspec"] = MsgspecCodec()
+        codecs["msgpack"] = MsgpackCodec()
+    return codecs
+
+
+def measure(function, iterations: int) -> float:
+    """Best of 3 runs, in microseconds per call"""
+    return min(timeit.repeat(function, number=iterations, repeat=3)) / iterations * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    codecs = get_codecs()
+    for action, frame in build_frames(args.items).items():
+        candidates = {"legacy model_dump + json.dumps": lambda frame=frame: json.dumps(frame.model_dump())}
+        candidates["model_dump_json"] = lambda frame=frame: frame.model_dump_json()
+        for name, codec in codecs.items():
+            candidates[f"model_dump + {name} codec"] = lambda codec=codec, frame=frame: codec.encode(
+                frame.model_dump()
+            )
+            candidates[f"{name} codec"] = lambda codec=codec, frame=frame: codec.encode(frame)
+
+        baseline = None
+        sizes = ", ".join(f"{name} {len(codec.encode(frame))} bytes" for name, codec in codecs.items())
+        print(f"Encode {action} ({args.items} items; {sizes}):")
+        print(f"{'path':>32} {'us/frame':>10} {'speedup':>8}")
+        for name, function in candidates.items():
+            elapsed = measure(function, args.iterations)
+            baseline = baseline or elapsed
+            print(f"{name:>32} {elapsed:>10.2f} {baseline / elapsed:>7.2f}x")
+        print()
+
+    inbound = {
+        "action": WebSocketActions.SEND_MESSAGE,
+        "request_id": "42",
+        "data": {"token": "x" * 200, "chat_uuid": str(uuid.uuid4()), "content": "Hello there!"},
+    }
+    print("Decode SEND_MESSAGE:")
+    print(f"{'path':>32} {'us/frame':>10} {'speedup':>8}")
+    baseline = None
+    for name, codec in codecs.items():
+        frame = codec.encode(inbound)
+        elapsed = measure(lambda codec=codec, frame=frame: codec.decode(frame), args.iterations)
+        baseline = baseline or elapsed
+        print(f"{name:>32} {elapsed:>10.2f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Load generation against the WebSocket API: `--clients` concurrent clients talking to `/` over real sockets.
+
+Starts `main:app` under uvicorn against a throwaway SQLite database (or `--database-url`, e.g. a local Postgres),
+registers every client, pairs them into direct chats, then runs a closed-loop mix of actions for `--duration`
+seconds. Reports throughput, p50/p95/p99 latency per action and the server's resident memory per connection
+(Linux only). `--output` writes the report as JSON, `--compare` prints the change against an earlier report, so
+runs of two commits can be compared. `--url` runs against an already started server instead.
+
+Usage: python -m benchmarks.load [--clients 50] [--duration 30] [--mix SEND_MESSAGE=70,GET_CHATS=25,LOGIN=5]
+                                 [--output report.json] [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+from websockets.asyncio.client import ClientConnection, connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "Benchmark1!"
+DEFAULT_MIX = "SEND_MESSAGE=70,GET_CHATS=25,LOGIN=5"
+MIX_ACTIONS = ("SEND_MESSAGE", "GET_CHATS", "GET_CHAT_MESSAGES", "GET_USERS", "LOGIN", "ME")
+
+
+@dataclass
+class ActionStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def to_dict(self, duration: float) -> dict:
+        report = {"count": len(self.latencies), "errors": self.errors, "per_second": len(self.latencies) / duration}
+        if self.latencies:
+            percentiles = (
+                statistics.quantiles(self.latencies, n=100) if len(self.latencies) > 1 else self.latencies * 99
+            )
+            report.update(
+                {
+                    "mean_ms": statistics.fmean(self.latencies),
+                    "p50_ms": percentiles[49],
+                    "p95_ms": percentiles[94],
+                    "p99_ms": percentiles[98],
+                    "max_ms": max(self.latencies),
+                }
+            )
+        return report
+
+
+class Client:
+    """One simulated user: requests carry a `request_id` so responses are told apart from pushed events"""
+
+    def __init__(self, number: int, run_id: str, stats: dict[str, ActionStats]) -> None:
+        self.email = f"load-{run_id}-{number}@bench.com"
+        self.nickname = f"load-{run_id}-{number}"
+        self.stats = stats
+        self.token: Optional[str] = None
+        self.chat_uuids: list[str] = []
+        self.websocket: Optional[ClientConnection] = None
+        self.pending: dict[str, asyncio.Future] = {}
+        self.reader: Optional[asyncio.Task] = None
+        self.events = 0
+
+    async def connect(self, url: str) -> None:
+        self.websocket = await connect(url, max_size=None)
+        self.reader = asyncio.create_task(self._read())
+
+    async def close(self) -> None:
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.websocket is not None:
+            await self.websocket.close()
+
+    async def request(self, action: str, data: Optional[dict] = None) -> dict:
+        request_id = uuid.uuid4().hex
+        payload = dict(data or {})
+        if self.token is not None and action not in ("REGISTER", "LOGIN"):
+            payload["token"] = self.token
+        response = self.pending[request_id] = asyncio.get_running_loop().create_future()
+
+        started_at = time.perf_counter()
+        await self.websocket.send(json.dumps({"action": action, "request_id": request_id, "data": payload}))
+        try:
+            frame = await response
+        finally:
+            self.pending.pop(request_id, None)
+        stats = self.stats.setdefault(action, ActionStats())
+        stats.latencies.append((time.perf_counter() - started_at) * 1000)
+        if frame.get("status") != "OK":
+            stats.errors += 1
+        return frame
+
+    async def register(self) -> None:
+        response = await self.request(
+            "REGISTER", {"email": self.email, "nickname": self.nickname, "password": PASSWORD}
+        )
+        self.token = response["data"]["access_token"]
+
+    async def load_chats(self) -> None:
+        response = await self.request("GET_CHATS")
+        self.chat_uuids = [chat["uuid"] for chat in response["data"]["chats"]]
+
+    async def perform(self, action: str) -> None:
+        if action == "SEND_MESSAGE":
+            if self.chat_uuids:
+                chat_uuid = random.choice(self.chat_uuids)
+                await self.request(action, {"chat_uuid": chat_uuid, "content": f"load message {uuid.uuid4().hex}"})
+        elif action == "GET_CHAT_MESSAGES":
+            if self.chat_uuids:
+                await self.request(action, {"chat_uuid": random.choice(self.chat_uuids)})
+        elif action == "LOGIN":
+            response = await self.request(action, {"email": self.email, "password": PASSWORD})
+            self.token = response["data"]["access_token"]
+        else:
+            await self.request(action)
+
+    async def _read(self) -> None:
+        try:
+            async for message in self.websocket:
+                frame = json.loads(message)
+                for item in frame["data"] if frame.get("action") == "BATCH" else [frame]:
+                    response = self.pending.get(item.get("request_id"))
+                    if item.get("action") == "PING":
+                        await self.websocket.send(json.dumps({"action": "PONG", "data": item["data"]}))
+                    elif response is not None and not response.done():
+                        response.set_result(item)
+                    else:
+                        self.events += 1
+        finally:
+            # The server closed the socket (e.g. a missed heartbeat), fail the run instead of waiting forever
+            for response in self.pending.values():
+                if not response.done():
+                    response.set_exception(ConnectionError(f"{self.nickname} was disconnected"))
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for entry in mix.split(","):
+        action, _, weight = entry.partition("=")
+        action = action.strip().upper()
+        if action not in MIX_ACTIONS:
+            raise argparse.ArgumentTypeError(
+                f"Unsupported action {action!r}, expected one of {', '.join(MIX_ACTIONS)}"
+            )
+        weights[action] = int(weight or 1)
+    return weights
+
+
+def get_resident_memory(pid: Optional[int]) -> Optional[int]:
+    """Resident set size of the process in bytes, None where /proc is not available"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, TypeError):
+        return None
+    return None
+
+
+def get_free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_schema(database_url: str) -> None:
+    """Creates the tables in a child interpreter, this process does not import the app (it may not run it at all)"""
+    script = (
+        "import asyncio\n"
+        "import api.models\n"
+        "from engine import Base, engine\n"
+        "async def create():\n"
+        "    async with engine.begin() as connection:\n"
+        "        await connection.run_sync(Base.metadata.create_all)\n"
+        "    await engine.dispose()\n"
+        "asyncio.run(create())\n"
+    )
+    subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, env={**os.environ, "DEFAULT_DATABASE_URL": database_url}, check=True
+    )
+
+
+async def start_server(database_url: str, port: int) -> subprocess.Popen:
+    create_schema(database_url)
+    # Every simulated client connects from 127.0.0.1 and sends as fast as it is answered, so the abuse limits are off
+    limits = {
+        "WEBSOCKET_RATE_LIMIT_PER_MINUTE": "0",
+        "WEBSOCKET_IP_RATE_LIMIT_PER_MINUTE": "0",
+        "WEBSOCKET_MAX_CONNECTIONS_PER_IP": "0",
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+            "--ws-per-message-deflate",
+            "false",
+        ],
+        cwd=ROOT,
+        env={**os.environ, **limits, "DEFAULT_DATABASE_URL": database_url},
+        stdout=subprocess.DEVNULL,
+    )
+    async with httpx.AsyncClient() as client:
+        for _ in range(300):
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                if (await client.get(f"http://127.0.0.1:{port}/ping")).status_code == 200:
+                    return server
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+
+async def run(args: argparse.Namespace, url: str, server_pid: Optional[int]) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    setup_stats: dict[str, ActionStats] = {}
+    stats: dict[str, ActionStats] = {}
+    clients = [Client(number, run_id, setup_stats) for number in range(args.clients)]
+    idle_memory = get_resident_memory(server_pid)
+
+    # Setup: connect and register everyone, pair neighbours into direct chats, then learn the chats
+    setup_started_at = time.perf_counter()
+    await asyncio.gather(*(client.connect(url) for client in clients))
+    await asyncio.gather(*(client.register() for client in clients))
+    await asyncio.gather(
+        *(
+            client.request("CREATE_CHAT", {"participant_email": clients[(number + 1) % len(clients)].email})
+            for number, client in enumerate(clients)
+            if number % 2 == 0 and len(clients) > 1
+        )
+    )
+    await asyncio.gather(*(client.load_chats() for client in clients))
+    setup_duration = time.perf_counter() - setup_started_at
+    connected_memory = get_resident_memory(server_pid)
+
+    for client in clients:
+        client.stats = stats
+    actions, weights = zip(*parse_mix(args.mix).items())
+    deadline = time.perf_counter() + args.duration
+
+    async def work(client: Client) -> None:
+        while time.perf_counter() < deadline:
+            await client.perform(random.choices(actions, weights)[0])
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(work(client) for client in clients))
+    duration = time.perf_counter() - started_at
+    loaded_memory = get_resident_memory(server_pid)
+    events = sum(client.events for client in clients)
+    await asyncio.gather(*(client.close() for client in clients))
+
+    requests = sum(len(action_stats.latencies) for action_stats in stats.values())
+    per_connection = None
+    if idle_memory is not None and connected_memory is not None:
+        per_connection = (connected_memory - idle_memory) / args.clients
+    return {
+        "commit": get_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "parameters": {
+            "clients": args.clients,
+            "duration": args.duration,
+            "mix": args.mix,
+            "think_ms": args.think_ms,
+            "url": args.url,
+        },
+        "setup": {
+            "seconds": setup_duration,
+            "actions": {action: action_stats.to_dict(setup_duration) for action, action_stats in setup_stats.items()},
+        },
+        "throughput": {"requests": requests, "seconds": duration, "per_second": requests / duration, "events": events},
+        "actions": {action: action_stats.to_dict(duration) for action, action_stats in sorted(stats.items())},
+        "memory": {
+            "idle_bytes": idle_memory,
+            "connected_bytes": connected_memory,
+            "loaded_bytes": loaded_memory,
+            "per_connection_bytes": per_connection,
+        },
+    }
+
+
+def print_report(report: dict, baseline: Optional[dict]) -> None:
+    def change(value: Optional[float], previous: Optional[float]) -> str:
+        if value is None or not previous:
+            return ""
+        return f"{(value - previous) / previous * 100:+.1f}%"
+
+    throughput = report["throughput"]
+    throughput_change = change(throughput["per_second"], (baseline or {}).get("throughput", {}).get("per_second"))
+    print(f"{report['parameters']['clients']} clients, {throughput['seconds']:.1f}s, commit {report['commit']}")
+    print(
+        f"throughput {throughput['per_second']:.0f} req/s {throughput_change}"
+        f" ({throughput['requests']} requests, {throughput['events']} pushed events)"
+    )
+    print(
+        f"{'action':>18} {'count':>8} {'errors':>7} {'req/s':>8}"
+        f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'p99 change':>11}"
+    )
+    for action, action_report in report["actions"].items():
+        previous = (baseline or {}).get("actions", {}).get(action, {})
+        p99_change = change(action_report.get("p99_ms"), previous.get("p99_ms"))
+        print(
+            f"{action:>18} {action_report['count']:>8} {action_report['errors']:>7}"
+            f" {action_report['per_second']:>8.0f} {action_report.get('p50_ms', 0):>8.2f}"
+            f" {action_report.get('p95_ms', 0):>8.2f} {action_report.get('p99_ms', 0):>8.2f} {p99_change:>11}"
+        )
+
+    memory = report["memory"]
+    if memory["per_connection_bytes"] is not None:
+        memory_change = change(
+            memory["per_connection_bytes"], (baseline or {}).get("memory", {}).get("per_connection_bytes")
+        )
+        print(
+            f"server memory: {memory['idle_bytes'] / 2**20:.1f} MiB idle,"
+            f" {memory['connected_bytes'] / 2**20:.1f} MiB connected,"
+            f" {memory['loaded_bytes'] / 2**20:.1f} MiB after the run,"
+            f" {memory['per_connection_bytes'] / 1024:.1f} KiB per connection {memory_change}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted actions, any of {', '.join(MIX_ACTIONS)}")
+    parser.add_argument("--think-ms", type=float, default=0, help="Pause of every client between two actions")
+    parser.add_argument("--database-url", help="Database for the started server instead of a throwaway SQLite file")
+    parser.add_argument("--url", help="WebSocket URL of an already running server, e.g. ws://127.0.0.1:8000/")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+    try:
+        parse_mix(args.mix)
+    except (argparse.ArgumentTypeError, ValueError) as exc:
+        parser.error(str(exc))
+    if args.clients < 2:
+        parser.error("--clients must be at least 2, clients chat in pairs")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    server = None
+    url = args.url
+    if url is None:
+        database_url = args.database_url
+        if database_url is None:
+            database_url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'load.sqlite3')}"
+        port = get_free_port()
+        server = await start_server(database_url, port)
+        url = f"ws://127.0.0.1:{port}/"
+
+    try:
+        report = await run(args, url, server.pid if server else None)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Memory of a long chat session: one DB session per socket lifetime vs one short-lived session per action.
+
+Runs SEND_MESSAGE through `api.actions.send_message` against a throwaway SQLite database and samples traced
+memory, the session identity map and the pool connections held between actions every `--sample-every` messages.
+
+Usage: python -m benchmarks.session_memory [--messages 10000] [--sample-every 1000]
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "session_memory.sqlite3")
+os.environ["DEFAULT_DATABASE_URL"] = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.actions import create_chat, send_message  # noqa: E402
+from api.auth import create_jwt_token, get_password_hash  # noqa: E402
+from api.crud.user import create_user  # noqa: E402
+from api.schemas.chat import ChatCreate  # noqa: E402
+from api.schemas.message import MessageCreate  # noqa: E402
+from engine import AsyncSessionLocal, Base, engine, session_scope  # noqa: E402
+
+
+async def prepare() -> tuple[str, str]:
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+    hashed_password = get_password_hash("Benchmark1!")
+    async with session_scope() as db:
+        await create_user(db, "sender@bench.com", "sender", hashed_password)
+        await create_user(db, "recipient@bench.com", "recipient", hashed_password)
+        token = create_jwt_token("sender@bench.com")
+        chat = await create_chat(ChatCreate(participant_email="recipient@bench.com"), db, token=token)
+    return token, chat.data.uuid
+
+
+async def run(mode: str, messages: int, sample_every: int) -> list[tuple[int, float, int, int]]:
+    token, chat_uuid = await prepare()
+    samples = []
+    gc.collect()
+    tracemalloc.start()
+
+    socket_session = AsyncSessionLocal() if mode == "socket" else None
+    try:
+        for number in range(1, messages + 1):
+            data = MessageCreate(chat_uuid=chat_uuid, content=f"message #{number}")
+            if socket_session is not None:
+                await send_message(data, socket_session, token)
+                identity_map_size = len(socket_session.identity_map)
+            else:
+                async with session_scope() as db:
+                    await send_message(data, db, token)
+                    identity_map_size = len(db.identity_map)
+
+            if number % sample_every == 0:
+                gc.collect()
+                current, _ = tracemalloc.get_traced_memory()
+                samples.append((number, current / 1024 / 1024, identity_map_size, engine.pool.checkedout()))
+    finally:
+        if socket_session is not None:
+            await socket_session.close()
+        tracemalloc.stop()
+
+    return samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--sample-every", type=int, default=1_000)
+    args = parser.parse_args()
+
+    for mode in ("socket", "action"):
+        print(f"Session per {mode}:")
+        print(f"{'messages':>10} {'traced MiB':>12} {'identity map':>14} {'held connections':>18}")
+        for number, memory, identity_map_size, connections in await run(mode, args.messages, args.sample_every):
+            print(f"{number:>10} {memory:>12.2f} {identity_map_size:>14} {connections:>18}")
+        print()
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+Message write throughput: one commit per SEND_MESSAGE vs the write-behind buffer of `api.message_writer`.
+
+Runs `--senders` concurrent senders through `api.actions.send_message`, `--messages` messages in total, and reports
+messages per second until every send was answered and until every row was committed. Uses a throwaway SQLite
+database unless `--database-url` points elsewhere (run it against Postgres for representative numbers).
+
+Usage: python -m benchmarks.write_behind [--messages 5000] [--senders 20] [--database-url URL]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "write_behind.sqlite3")
+if "--database-url" in sys.argv:
+    os.environ["DEFAULT_DATABASE_URL"] = sys.argv[sys.argv.index("--database-url") + 1]
+else:
+    os.environ["DEFAULT_DATABASE_URL"] = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from api.actions import create_chat, send_message  # noqa: E402
+from api.auth import create_jwt_token, get_password_hash  # noqa: E402
+from api.crud.user import create_user  # noqa: E402
+from api.message_writer import message_writer  # noqa: E402
+from api.models import Message  # noqa: E402
+from api.schemas.chat import ChatCreate  # noqa: E402
+from api.schemas.message import MessageCreate  # noqa: E402
+from engine import Base, engine, session_scope  # noqa: E402
+
+MODES = {
+    "commit per message": None,
+    "write-behind, durable ack": "durable",
+    "write-behind, delivered ack": "delivered",
+}
+
+
+async def prepare() -> tuple[str, str]:
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+    hashed_password = get_password_hash("Benchmark1!")
+    async with session_scope() as db:
+        await create_user(db, "sender@bench.com", "sender", hashed_password)
+        await create_user(db, "recipient@bench.com", "recipient", hashed_password)
+        token = create_jwt_token("sender@bench.com")
+        chat = await create_chat(ChatCreate(participant_email="recipient@bench.com"), db, token=token)
+    return token, chat.data.uuid
+
+
+async def count_messages() -> int:
+    async with session_scope() as db:
+        return await db.scalar(select(func.count(Message.id)))
+
+
+async def run(ack: str, messages: int, senders: int) -> tuple[float, float]:
+    token, chat_uuid = await prepare()
+    message_writer.enabled = ack is not None
+    message_writer.ack = ack or "durable"
+    message_writer.start()
+
+    async def sender(number: int) -> None:
+        for sequence in range(number, messages, senders):
+            async with session_scope() as db:
+                await send_message(MessageCreate(chat_uuid=chat_uuid, content=f"message #{sequence}"), db, token)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(sender(number) for number in range(senders)))
+    answered_in = time.perf_counter() - started_at
+    await message_writer.stop()
+    committed_in = time.perf_counter() - started_at
+
+    written = await count_messages()
+    assert written == messages, f"{written} of {messages} messages were written"
+    return messages / answered_in, messages / committed_in
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5_000)
+    parser.add_argument("--senders", type=int, default=20)
+    parser.add_argument("--database-url", help="Database to run against instead of a throwaway SQLite file")
+    args = parser.parse_args()
+
+    print(f"{args.messages} messages, {args.senders} concurrent senders")
+    print(f"{'mode':>30} {'answered msg/s':>16} {'committed msg/s':>17}")
+    for name, ack in MODES.items():
+        answered, committed = await run(ack, args.messages, args.senders)
+        print(f"{name:>30} {answered:>16.0f} {committed:>17.0f}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,243 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import WebSocket
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.auth import decrypt_connection_token
+from api.exceptions import WebSocketValidationException
+from engine import session_scope
+from managers import manager
+from utils import config
+from utils.enums import ResponseStatuses
+from utils.logging_config import logger
+from utils.metrics import LatencyHistogram
+
+
+@dataclass
+class ActionContext:
+    """State of a single inbound frame while it travels through the middleware chain"""
+
+    action: str
+    payload: dict
+    websocket: WebSocket
+    encrypted_token: str = ""
+    token: Optional[str] = None
+    db: Optional[AsyncSession] = None
+
+
+Handler = Callable[[Optional[BaseModel], ActionContext], Awaitable[Any]]
+CallNext = Callable[[ActionContext], Awaitable[Optional[dict]]]
+Middleware = Callable[[ActionContext, CallNext], Awaitable[Optional[dict]]]
+
+
+@dataclass(frozen=True)
+class ActionRoute:
+    handler: Handler
+    request_schema: Optional[type[BaseModel]] = None
+    response_model: Optional[type[BaseModel]] = None
+    requires_token: bool = True
+    # Pipelined frames with the same ordering key are handled one after another, in arrival order
+    ordering_key: Optional[Callable[[dict], Optional[str]]] = None
+    # Exclusive actions (e.g. the ones changing the socket's auth state) wait until nothing else is in flight
+    exclusive: bool = False
+    # Largest inbound frame accepted for the action, in bytes
+    max_frame_size: int = config.WEBSOCKET_DEFAULT_FRAME_SIZE
+
+
+@dataclass
+class ActionDispatcher:
+    """Maps every WebSocket action to its route and runs it through the middleware chain"""
+
+    routes: Dict[str, ActionRoute] = field(default_factory=dict)
+    middlewares: list[Middleware] = field(default_factory=list)
+    latency: Dict[str, LatencyHistogram] = field(default_factory=dict)
+    _chain: Optional[CallNext] = field(default=None, repr=False)
+
+    def action(
+        self,
+        name: str,
+        request_schema: Optional[type[BaseModel]] = None,
+        response_model: Optional[type[BaseModel]] = None,
+        requires_token: bool = True,
+        ordering_key: Optional[Callable[[dict], Optional[str]]] = None,
+        exclusive: bool = False,
+        max_frame_size: int = config.WEBSOCKET_DEFAULT_FRAME_SIZE,
+    ):
+        def decorator(handler: Handler) -> Handler:
+            self.routes[name] = ActionRoute(
+                handler, request_schema, response_model, requires_token, ordering_key, exclusive, max_frame_size
+            )
+            return handler
+
+        return decorator
+
+    def get_max_frame_size(self, action: Optional[str]) -> int:
+        route = self.routes.get(action)
+        return route.max_frame_size if route is not None else config.WEBSOCKET_DEFAULT_FRAME_SIZE
+
+    def middleware(self, middleware: Middleware) -> Middleware:
+        """Registers a middleware, the first registered one is the outermost"""
+        self.middlewares.append(middleware)
+        self._chain = None
+        return middleware
+
+    async def dispatch(self, websocket: WebSocket, data: dict) -> Optional[dict | BaseModel]:
+        """Response frame of the action, pydantic models are left to the connection codec to serialize"""
+        response = await self._dispatch(websocket, data)
+        request_id = data.get("request_id")
+        if response is not None and request_id is not None:
+            if isinstance(response, BaseModel):
+                response = response.model_dump(mode="json")
+            response["request_id"] = request_id
+        return response
+
+    async def _dispatch(self, websocket: WebSocket, data: dict) -> Optional[dict]:
+        payload = data.get("data") or {}
+        context = ActionContext(
+            action=data.get("action"),
+            payload=payload,
+            websocket=websocket,
+            encrypted_token=payload.pop("token", ""),
+        )
+
+        if self._chain is None:
+            self._chain = self._call_route
+            for middleware in reversed(self.middlewares):
+                self._chain = self._bind(middleware, self._chain)
+        return await self._chain(context)
+
+    @staticmethod
+    def _bind(middleware: Middleware, call_next: CallNext) -> CallNext:
+        async def wrapper(context: ActionContext) -> Optional[dict]:
+            return await middleware(context, call_next)
+
+        return wrapper
+
+    async def _call_route(self, context: ActionContext) -> Optional[dict]:
+        route = self.routes.get(context.action)
+        if route is None:
+            raise WebSocketValidationException(detail="Unknown action!", action=context.action, field="action")
+
+        request = route.request_schema(**context.payload) if route.request_schema else None
+        # The session is checked out for this action only and returned to the pool before the response is sent
+        async with session_scope() as db:
+            context.db = db
+            response = await route.handler(request, context)
+        context.db = None
+        return response
+
+
+async def timing_middleware(context: ActionContext, call_next: CallNext) -> Optional[dict]:
+    started_at = time.perf_counter()
+    try:
+        return await call_next(context)
+    finally:
+        if context.action in dispatcher.routes:
+            histogram = dispatcher.latency.setdefault(context.action, LatencyHistogram())
+            histogram.observe((time.perf_counter() - started_at) * 1000)
+
+
+async def error_mapping_middleware(context: ActionContext, call_next: CallNext) -> Optional[dict]:
+    try:
+        return await call_next(context)
+    except ValidationError as exc:
+        error = exc.errors()[0]
+        field_name = error.get("loc")[0] if error.get("loc") else None
+        ctx_error = (error.get("ctx") or {}).get("error")
+        detail = str(ctx_error) if ctx_error else error.get("msg")
+        return WebSocketValidationException(action=context.action, detail=detail, field=field_name).to_dict()
+    except WebSocketValidationException as exc:
+        exc.action = exc.action if exc.action not in (None, "ANY") else context.action
+        return exc.to_dict()
+
+
+async def auth_middleware(context: ActionContext, call_next: CallNext) -> Optional[dict]:
+    context.token = decrypt_connection_token(context.websocket, context.encrypted_token)
+    route = dispatcher.routes.get(context.action)
+    if route is not None and route.requires_token and context.token is None:
+        raise WebSocketValidationException(detail="Token is missing", action=context.action)
+    return await call_next(context)
+
+
+dispatcher = ActionDispatcher()
+dispatcher.middleware(timing_middleware)
+dispatcher.middleware(error_mapping_middleware)
+dispatcher.middleware(auth_middleware)
+
+
+def get_latency_metrics() -> dict:
+    return {action: histogram.to_dict() for action, histogram in dispatcher.latency.items()}
+
+
+class ConnectionPipeline:
+    """
+    Opt-in per-socket pipelining: frames carrying a `request_id` are handled concurrently, at most
+    `max_in_flight` at a time, and their responses echo the `request_id`. Frames without one are handled inline.
+    """
+
+    def __init__(self, websocket: WebSocket, max_in_flight: int = config.PIPELINE_MAX_IN_FLIGHT) -> None:
+        self.websocket = websocket
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight: set[asyncio.Task] = set()
+        # Last task submitted for each ordering key
+        self.ordering_tails: Dict[str, asyncio.Task] = {}
+
+    async def submit(self, data: dict) -> None:
+        route = dispatcher.routes.get(data.get("action"))
+        if data.get("request_id") is None or route is None or route.exclusive:
+            await self.drain()
+            response = await dispatcher.dispatch(self.websocket, data)
+            if response is not None:
+                await manager.send_json(response, self.websocket)
+            return
+
+        # Reading the next frame waits for a free slot, which is the socket's backpressure
+        await self.slots.acquire()
+        key = route.ordering_key(data.get("data") or {}) if route.ordering_key else None
+        previous = self.ordering_tails.get(key) if key else None
+        task = asyncio.create_task(self._run(data, previous))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+        if key:
+            self.ordering_tails[key] = task
+            task.add_done_callback(lambda done: self._release_tail(key, done))
+
+    def _release_tail(self, key: str, task: asyncio.Task) -> None:
+        if self.ordering_tails.get(key) is task:
+            del self.ordering_tails[key]
+
+    async def _run(self, data: dict, previous: Optional[asyncio.Task]) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            response = await dispatcher.dispatch(self.websocket, data)
+            if response is not None:
+                await manager.send_json(response, self.websocket)
+        except Exception as exc:
+            logger.error(f"Pipelined action {data.get('action')} failed: {exc}")
+            try:
+                await manager.send_json(
+                    {
+                        "status": ResponseStatuses.ERROR,
+                        "action": data.get("action"),
+                        "request_id": data.get("request_id"),
+                        "message": "Something went wrong.",
+                    },
+                    self.websocket,
+                )
+            except Exception:
+                pass
+        finally:
+            self.slots.release()
+
+    async def drain(self) -> None:
+        if self.in_flight:
+            await asyncio.wait(list(self.in_flight))
+
+    def cancel(self) -> None:
+        for task in self.in_flight:
+            task.cancel()
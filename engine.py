@@ -1,32 +1,50 @@
-from sqlalchemy import NullPool
+from contextlib import asynccontextmanager
+
+from sqlalchemy import AsyncAdaptedQueuePool, NullPool
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 
 from utils import config
 
-if config.IS_DEPLOY_BRANCH:
-    engine = create_async_engine(
-        config.DATABASE_URL,
-        echo=True,
-        poolclass=NullPool,
-        connect_args={
-            "prepared_statement_cache_size": 0,
-            "statement_cache_size": 0,
-        },
-    )
-else:
-    engine = create_async_engine(
-        config.DATABASE_URL,
-        echo=True,
-        poolclass=NullPool,
-    )
+# asyncpg prepared statement caches break on transaction-mode PgBouncer, where every transaction may run on
+# a different server connection
+PGBOUNCER_CONNECT_ARGS = {
+    "prepared_statement_cache_size": 0,
+    "statement_cache_size": 0,
+}
+
+
+def get_engine_options(profile: str) -> dict:
+    options = {"echo": config.DATABASE_ECHO}
+
+    if profile == "null":
+        options["poolclass"] = NullPool
+    else:
+        options.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=config.DATABASE_POOL_SIZE,
+            max_overflow=config.DATABASE_MAX_OVERFLOW,
+            pool_timeout=config.DATABASE_POOL_TIMEOUT,
+            pool_recycle=config.DATABASE_POOL_RECYCLE,
+            pool_pre_ping=config.DATABASE_POOL_PRE_PING,
+        )
+
+    if profile == "pgbouncer" or (profile == "null" and config.IS_DEPLOY_BRANCH):
+        options["connect_args"] = PGBOUNCER_CONNECT_ARGS
+
+    return options
+
+
+engine = create_async_engine(config.DATABASE_URL, **get_engine_options(config.DATABASE_POOL_PROFILE))
 AsyncSessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
 
 
 Base = declarative_base()
 
 
-async def get_db():
+@asynccontextmanager
+async def session_scope():
+    """Short-lived session, checked out of the pool for a single unit of work"""
     async with AsyncSessionLocal() as session:
         try:
             yield session
@@ -34,5 +52,8 @@ async def get_db():
         except Exception:
             await session.rollback()
             raise
-        finally:
-            await session.close()
+
+
+async def get_db():
+    async with session_scope() as session:
+        yield session
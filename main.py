@@ -1,13 +1,10 @@
 import asyncio
 from contextlib import asynccontextmanager
-from pprint import pprint
 
-import httpx
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.params import Depends
-from pydantic import ValidationError
-from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.websockets import WebSocketState
 
+from anomaly_monitoring import monitor
 from api.actions import (
     create_chat,
     get_chat_messages,
@@ -19,34 +16,57 @@ from api.actions import (
     register,
     send_message,
 )
-from api.auth import decrypt_jwt
-from api.exceptions import WebSocketValidationException
-from api.schemas.chat import ChatCreate
-from api.schemas.message import GetChatMessages, MessageCreate
-from api.schemas.user import UserCreate, UserLogin
-from engine import get_db
-from managers import manager
-from utils.enums import SCHEMA_TO_ACTION_MAPPER, ResponseStatuses, WebSocketActions
-from utils.utils import cleanup_blacklisted_tokens, remove_websocket_by_value
+from api.auth import password_hashing_executor
+from api.blacklist import sync_token_blacklist_periodically, token_blacklist
+from api.conversations import conversation_cache
+from api.membership import chat_membership
+from api.message_writer import message_writer
+from api.schemas.auth import AuthResponse
+from api.schemas.chat import (
+    ChatCreate,
+    GetChats,
+    WebsocketChatCreateResponse,
+    WebsocketChatResponse,
+)
+from api.schemas.message import (
+    GetChatMessages,
+    MessageCreate,
+    WebsocketMessageCreateResponse,
+    WebsocketMessagesResponse,
+)
+from api.schemas.user import GetUsers, UserCreate, UserLogin, WebsocketUserResponse
+from dispatcher import (
+    ActionContext,
+    ConnectionPipeline,
+    dispatcher,
+    get_latency_metrics,
+)
+from engine import get_db, session_scope
+from managers import is_frame_oversized, manager
+from utils import config
+from utils.enums import ResponseStatuses, WebSocketActions
+from utils.timer_wheel import timer_wheel
+from utils.utils import cleanup_blacklisted_tokens
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    ping_pong_task = asyncio.create_task(ping_pong())
+    await manager.start()
+    message_writer.start()
+    timer_wheel.start()
+    async with session_scope() as db:
+        await token_blacklist.sync(db)
+    blacklist_sync_task = asyncio.create_task(sync_token_blacklist_periodically())
     yield
-    ping_pong_task.cancel()
+    blacklist_sync_task.cancel()
+    timer_wheel.stop()
+    password_hashing_executor.shutdown()
+    await message_writer.stop()
+    await manager.stop()
     async for db in get_db():
         await cleanup_blacklisted_tokens(db=db)
 
 
-async def ping_pong():
-    async with httpx.AsyncClient() as client:
-        while True:
-            response = await client.get("http://localhost:8000/ping")
-            print(f"Health check response: {response.json()}")
-            await asyncio.sleep(45)
-
-
 app = FastAPI(
     lifespan=lifespan,
 )
@@ -64,83 +84,177 @@ async def ping():
     return {"message": "pong"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "actions_latency": get_latency_metrics(),
+        "heartbeat_rtt": manager.heartbeat_rtt.to_dict(),
+        "outbound": {
+            "queued_frames": sum(
+                len(session.outbound.frames) for session in manager.active_connections.values() if session.outbound
+            ),
+            "dropped_frames": manager.dropped_frames,
+            "slow_consumer_disconnects": manager.slow_consumer_disconnects,
+            "oversized_frames": manager.oversized_frames,
+            "idle_disconnects": manager.idle_disconnects,
+            "heartbeat_timeouts": manager.heartbeat_timeouts,
+            "compression": manager.compressor.to_dict(),
+        },
+        "password_hashing": {
+            "workers": password_hashing_executor.max_workers,
+            "in_flight": password_hashing_executor.in_flight,
+            "queue_depth": password_hashing_executor.queue_depth,
+        },
+        "conversation_cache": {
+            "cached_users": len(conversation_cache.lists),
+            "hits": conversation_cache.hits,
+            "misses": conversation_cache.misses,
+        },
+        "chat_membership_cache": {
+            "cached_chats": len(chat_membership.entries),
+            "hits": chat_membership.hits,
+            "misses": chat_membership.misses,
+        },
+        "message_write_behind": {
+            "enabled": message_writer.enabled,
+            "pending": len(message_writer.pending),
+            "written": message_writer.written,
+            "batches": message_writer.batches,
+            "failed": message_writer.failed,
+        },
+        "timers": {
+            "scheduled": len(timer_wheel),
+            "expired": timer_wheel.expired,
+        },
+        "monitor": {
+            "connections": len(monitor.connections),
+            "ips": len(monitor.ip_connections),
+            "blocked_ips": len(monitor.blocked_ips),
+            "rate_limited_messages": monitor.rate_limited_messages,
+            "suspicious_messages": monitor.suspicious_messages,
+            "scanned_frames": monitor.scanner.scanned,
+            "truncated_scans": monitor.scanner.truncated,
+            "timed_out_scans": monitor.scanner.timed_out,
+        },
+    }
+
+
+@dispatcher.action(
+    WebSocketActions.REGISTER,
+    request_schema=UserCreate,
+    response_model=AuthResponse,
+    requires_token=False,
+    exclusive=True,
+    max_frame_size=config.WEBSOCKET_AUTH_FRAME_SIZE,
+)
+async def handle_register(request: UserCreate, context: ActionContext):
+    return await register(request, context.db, context.websocket)
+
+
+@dispatcher.action(
+    WebSocketActions.LOGIN,
+    request_schema=UserLogin,
+    response_model=AuthResponse,
+    requires_token=False,
+    exclusive=True,
+    max_frame_size=config.WEBSOCKET_AUTH_FRAME_SIZE,
+)
+async def handle_login(request: UserLogin, context: ActionContext):
+    return await login(request, context.db, context.websocket)
+
+
+@dispatcher.action(WebSocketActions.LOGOUT, exclusive=True)
+async def handle_logout(request: None, context: ActionContext):
+    await logout(context.websocket, token=context.token, db=context.db)
+    return {
+        "status": ResponseStatuses.OK,
+        "action": WebSocketActions.LOGOUT,
+        "message": "Successful logout!",
+    }
+
+
+@dispatcher.action(WebSocketActions.ME, response_model=AuthResponse)
+async def handle_me(request: None, context: ActionContext):
+    return await me(token=context.token, db=context.db, websocket=context.websocket)
+
+
+@dispatcher.action(WebSocketActions.GET_CHATS, request_schema=GetChats, response_model=WebsocketChatResponse)
+async def handle_get_chats(request: GetChats, context: ActionContext):
+    return await get_chats_list(db=context.db, token=context.token, websocket=context.websocket, since=request.since)
+
+
+@dispatcher.action(WebSocketActions.GET_USERS, request_schema=GetUsers, response_model=WebsocketUserResponse)
+async def handle_get_users(request: GetUsers, context: ActionContext):
+    return await get_users(request, db=context.db, token=context.token, websocket=context.websocket)
+
+
+@dispatcher.action(
+    WebSocketActions.CREATE_CHAT,
+    request_schema=ChatCreate,
+    response_model=WebsocketChatCreateResponse,
+    ordering_key=lambda payload: f"chat-with:{payload.get('participant_email')}",
+)
+async def handle_create_chat(request: ChatCreate, context: ActionContext):
+    return await create_chat(request, context.db, token=context.token, websocket=context.websocket)
+
+
+@dispatcher.action(
+    WebSocketActions.GET_CHAT_MESSAGES, request_schema=GetChatMessages, response_model=WebsocketMessagesResponse
+)
+async def handle_get_chat_messages(request: GetChatMessages, context: ActionContext):
+    return await get_chat_messages(request, context.db, token=context.token, websocket=context.websocket)
+
+
+@dispatcher.action(
+    WebSocketActions.SEND_MESSAGE,
+    request_schema=MessageCreate,
+    response_model=WebsocketMessageCreateResponse,
+    ordering_key=lambda payload: f"chat:{payload.get('chat_uuid')}",
+    max_frame_size=config.WEBSOCKET_MESSAGE_FRAME_SIZE,
+)
+async def handle_send_message(request: MessageCreate, context: ActionContext):
+    return await send_message(request, context.db, context.token, context.websocket)
+
+
 @app.websocket("/")
-async def check_connection(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
+async def check_connection(websocket: WebSocket):
+    if not await monitor.handle_new_connection(websocket, websocket.client.host if websocket.client else ""):
+        await websocket.close(code=1008, reason="Connection rejected")
+        return
+
     await manager.connect(websocket)
+    pipeline = ConnectionPipeline(websocket)
     try:
         while True:
-            data: dict = await manager.get_json(websocket)
-            action = data.get("action")
-            encrypted_token = data["data"].pop("token", "")
-            if encrypted_token:
-                token = decrypt_jwt(encrypted_token)
-            else:
-                token = None
-            try:
-                if action == WebSocketActions.REGISTER:
-                    user_data = UserCreate(**data.get("data"))
-                    response = await register(user_data, db, websocket)
-                    pprint(manager.socket_to_user)
-
-                    await manager.send_json(response.dict(), websocket)
-
-                elif action == WebSocketActions.LOGIN:
-                    login_form = UserLogin(**data.get("data"))
-                    response = await login(login_form, db, websocket)
-                    pprint(manager.socket_to_user)
-                    await manager.send_json(response.dict(), websocket)
-
-                elif action == WebSocketActions.LOGOUT:
-                    await logout(websocket, token=token, db=db)
-                    await websocket.send_json(
-                        {
-                            "status": ResponseStatuses.OK,
-                            "action": WebSocketActions.LOGOUT,
-                            "message": "Successful logout!",
-                        }
-                    )
-
-                elif action == WebSocketActions.ME:
-                    response = await me(token=token, db=db)
-                    await manager.send_json(response.dict(), websocket)
-
-                elif action == WebSocketActions.GET_CHATS:
-                    response = await get_chats_list(db=db, token=token)
-                    await manager.send_json(response.dict(), websocket)
-
-                elif action == WebSocketActions.GET_USERS:
-                    response = await get_users(db=db, token=token)
-                    await manager.send_json(response.dict(), websocket)
-
-                elif action == WebSocketActions.CREATE_CHAT:
-                    chat_data = ChatCreate(**data.get("data"))
-                    response = await create_chat(chat_data, db, token=token)
-                    await manager.send_json(response.dict(), websocket)
-                elif action == WebSocketActions.GET_CHAT_MESSAGES:
-                    chat_messages_data = GetChatMessages(**data.get("data"))
-                    response = await get_chat_messages(chat_messages_data, db, token=token)
-                    await manager.send_json(response.dict(), websocket)
-
-                elif action == WebSocketActions.SEND_MESSAGE:
-                    message_data = MessageCreate(**data.get("data"))
-                    response = await send_message(message_data, db, token)
-                    await manager.send_json(response.dict(), websocket)
-
-            except ValidationError as exc:
-                action = SCHEMA_TO_ACTION_MAPPER.get(exc.title)
-                error = exc.errors()[0]
-                field = error.get("loc")[0]
-                detail = str(error.get("ctx").get("error"))
-                wc_validation_exception = WebSocketValidationException(action=action, detail=detail, field=field)
-                await manager.send_json(wc_validation_exception.to_dict(), websocket)
-    except WebSocketValidationException as ws_exc:
-        await manager.send_json(ws_exc.to_dict(), websocket)
+            frame = await manager.receive_frame(websocket)
+            # Size is checked on the raw frame: against the largest action limit before decoding, then per action
+            if is_frame_oversized(frame, config.WEBSOCKET_MAX_FRAME_SIZE):
+                manager.oversized_frames += 1
+                await close_connection(websocket, pipeline, code=1009, reason="Frame too large")
+                return
+            if not await monitor.handle_message(websocket, frame):
+                # Rate limit exceeded, suspicious content is only logged by the monitor
+                await close_connection(websocket, pipeline, code=1008, reason="Message rejected")
+                return
+            data: dict = manager.decode_frame(websocket, frame)
+            if is_frame_oversized(frame, dispatcher.get_max_frame_size(data.get("action"))):
+                manager.oversized_frames += 1
+                await close_connection(websocket, pipeline, code=1009, reason="Frame too large")
+                return
+            if data.get("action") == WebSocketActions.PONG:
+                # Answered here rather than through the pipeline, so the round trip is not skewed by slow actions
+                manager.handle_pong(websocket, data.get("data"))
+                continue
+            await pipeline.submit(data)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pipeline.cancel()
+        await monitor.handle_disconnect(websocket)
+        await manager.disconnect(websocket)
 
     except Exception as exc:
         print(f"Exception: {exc}")
+        pipeline.cancel()
         await manager.send_json(
             {
                 "status": ResponseStatuses.ERROR,
@@ -149,5 +263,13 @@ async def check_connection(websocket: WebSocket, db: AsyncSession = Depends(get_
             },
             websocket,
         )
-        remove_websocket_by_value(manager.socket_to_user, websocket)
-        manager.disconnect(websocket)
+        await monitor.handle_disconnect(websocket)
+        await manager.disconnect(websocket)
+
+
+async def close_connection(websocket: WebSocket, pipeline: ConnectionPipeline, code: int, reason: str) -> None:
+    pipeline.cancel()
+    if websocket.application_state == WebSocketState.CONNECTED:
+        await websocket.close(code=code, reason=reason)
+    await monitor.handle_disconnect(websocket)
+    await manager.disconnect(websocket)
@@ -1,35 +1,701 @@
+import asyncio
+import json
+import time
 import uuid
-from typing import Dict
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple, Union
 
-from fastapi import WebSocket
+import asyncpg
+from fastapi import WebSocket, WebSocketDisconnect
 
-from utils.utils import remove_websocket_by_value
+from utils import config
+from utils.enums import WebSocketActions
+from utils.logging_config import logger
+from utils.metrics import LatencyHistogram
+from utils.serialization import JsonCodec, get_codec, get_subprotocol_codec
+from utils.timer_wheel import timer_wheel
 
+BrokerHandler = Callable[[uuid.UUID, dict], Awaitable[None]]
+EventListener = Callable[[uuid.UUID, dict], None]
+
+# Appended to a subprotocol (e.g. "chat.v1.json+deflate") to get outbound frames above the size threshold compressed
+COMPRESSION_SUBPROTOCOL_SUFFIX = "+deflate"
+# Appended to a subprotocol (e.g. "chat.v1.json+heartbeat" or "chat.v1.json+deflate+heartbeat") to get the socket
+# PINGed, see WebSocketActions.PING
+HEARTBEAT_SUBPROTOCOL_SUFFIX = "+heartbeat"
+# First byte of every binary frame sent on a "+deflate" socket, telling zlib streams from plain encoded frames
+PLAIN_FRAME_MARKER = b"\x00"
+COMPRESSED_FRAME_MARKER = b"\x01"
+
+
+class MessageBroker(ABC):
+    """Pub/sub backbone delivering events to users connected to other processes"""
 
-class ConnectionManager:
     def __init__(self) -> None:
-        self.active_connections: list[WebSocket] = []
-        self.socket_to_user: Dict[uuid.UUID, WebSocket] = {}
+        self.node_id: Optional[str] = None
+        self.handler: Optional[BrokerHandler] = None
 
-    async def connect(self, websocket: WebSocket) -> None:
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    async def start(self, node_id: str, handler: BrokerHandler) -> None:
+        self.node_id = node_id
+        self.handler = handler
 
-    @staticmethod
-    async def get_json(websocket: WebSocket):
-        return await websocket.receive_json()
+    async def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    async def subscribe(self, user_uuid: uuid.UUID) -> None:
+        """Starts delivering the user's events to this process, a no-op when already subscribed"""
+
+    @abstractmethod
+    async def unsubscribe(self, user_uuid: uuid.UUID) -> None:
+        """Stops delivering the user's events to this process, a no-op when not subscribed"""
+
+    @abstractmethod
+    async def publish(self, user_uuid: uuid.UUID, data: dict) -> None:
+        pass
+
+
+class InMemoryBrokerHub:
+    """Local stand-in for an external broker, shared by every InMemoryBroker of the process"""
+
+    def __init__(self) -> None:
+        self.subscribers: Dict[uuid.UUID, Dict[str, BrokerHandler]] = {}
+
+
+in_memory_broker_hub = InMemoryBrokerHub()
+
+
+class InMemoryBroker(MessageBroker):
+    def __init__(self, hub: InMemoryBrokerHub = in_memory_broker_hub) -> None:
+        super().__init__()
+        self.hub = hub
+
+    async def stop(self) -> None:
+        for nodes in list(self.hub.subscribers.values()):
+            nodes.pop(self.node_id, None)
+
+    async def subscribe(self, user_uuid: uuid.UUID) -> None:
+        self.hub.subscribers.setdefault(user_uuid, {})[self.node_id] = self.handler
+
+    async def unsubscribe(self, user_uuid: uuid.UUID) -> None:
+        nodes = self.hub.subscribers.get(user_uuid)
+        if nodes is None:
+            return
+        nodes.pop(self.node_id, None)
+        if not nodes:
+            del self.hub.subscribers[user_uuid]
+
+    async def publish(self, user_uuid: uuid.UUID, data: dict) -> None:
+        for node_id, handler in list(self.hub.subscribers.get(user_uuid, {}).items()):
+            if node_id != self.node_id:
+                await handler(user_uuid, data)
+
+
+class PostgresBroker(MessageBroker):
+    """
+    Broker on top of Postgres LISTEN/NOTIFY, one channel per user.
+    Requires a session-level connection, so it must not go through PgBouncer in transaction mode.
+    """
+
+    # Postgres rejects NOTIFY payloads of 8000 bytes and more
+    MAX_PAYLOAD_SIZE = 7999
+    # Seconds between attempts to re-establish a dropped LISTEN connection
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, dsn: str) -> None:
+        super().__init__()
+        self.dsn = dsn
+        self._listen_connection = None
+        self._publish_pool = None
+        # Users listened to, so their channels can be listened to again on a new connection
+        self.subscriptions: Set[uuid.UUID] = set()
+        # Strong references to the handler tasks, the event loop only keeps weak ones
+        self.tasks: Set[asyncio.Task] = set()
+        self.reconnect_task: Optional[asyncio.Task] = None
+        self.stopping = False
+        # Serializes every LISTEN/UNLISTEN on the shared connection and the swap to a new one
+        self.lock = asyncio.Lock()
 
     @staticmethod
-    async def send_json(data: dict, websocket: WebSocket):
-        return await websocket.send_json(data)
+    def _channel(user_uuid: uuid.UUID) -> str:
+        return f"user_{user_uuid.hex}"
+
+    async def start(self, node_id: str, handler: BrokerHandler) -> None:
+        await super().start(node_id, handler)
+        self.stopping = False
+        await self._connect_listener()
+        self._publish_pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=config.MESSAGE_BROKER_POOL_SIZE)
+
+    async def stop(self) -> None:
+        self.stopping = True
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+        if self._listen_connection is not None:
+            await self._listen_connection.close()
+        if self._publish_pool is not None:
+            await self._publish_pool.close()
+
+    async def _connect_listener(self) -> None:
+        connection = await asyncpg.connect(self.dsn)
+        connection.add_termination_listener(self._on_listener_terminated)
+        # Swapped in under the lock, so a user subscribed meanwhile is either listened to here or by subscribe()
+        async with self.lock:
+            try:
+                for user_uuid in list(self.subscriptions):
+                    await connection.add_listener(self._channel(user_uuid), self._on_notification)
+            except Exception:
+                connection.terminate()
+                raise
+            self._listen_connection = connection
+
+    def _on_listener_terminated(self, connection) -> None:
+        if self.stopping or connection is not self._listen_connection or self.reconnect_task is not None:
+            return
+        logger.error("Message broker LISTEN connection was lost, reconnecting")
+        self.reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        """Opens a new LISTEN connection and listens to every subscribed user again, until it succeeds"""
+        try:
+            while not self.stopping:
+                try:
+                    await self._connect_listener()
+                except Exception as exc:
+                    logger.error(f"Message broker reconnect failed: {exc}")
+                    await asyncio.sleep(self.RECONNECT_DELAY)
+                    continue
+                logger.info(f"Message broker reconnected, listening to {len(self.subscriptions)} users")
+                return
+        finally:
+            self.reconnect_task = None
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str) -> None:
+        notification = json.loads(payload)
+        if notification["origin"] == self.node_id:
+            return
+        user_uuid = uuid.UUID(hex=channel.removeprefix("user_"))
+        task = asyncio.create_task(self.handler(user_uuid, notification["data"]))
+        self.tasks.add(task)
+        task.add_done_callback(self._on_handler_done)
+
+    def _on_handler_done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Message broker event delivery failed: {task.exception()}")
+
+    def _is_listening(self) -> bool:
+        return self._listen_connection is not None and not self._listen_connection.is_closed()
+
+    async def subscribe(self, user_uuid: uuid.UUID) -> None:
+        async with self.lock:
+            if user_uuid in self.subscriptions:
+                return
+            self.subscriptions.add(user_uuid)
+            # While reconnecting the user is picked up by the new connection
+            if self._is_listening():
+                await self._listen_connection.add_listener(self._channel(user_uuid), self._on_notification)
+
+    async def unsubscribe(self, user_uuid: uuid.UUID) -> None:
+        async with self.lock:
+            if user_uuid not in self.subscriptions:
+                return
+            self.subscriptions.discard(user_uuid)
+            if self._is_listening():
+                await self._listen_connection.remove_listener(self._channel(user_uuid), self._on_notification)
+
+    async def publish(self, user_uuid: uuid.UUID, data: dict) -> None:
+        payload = json.dumps({"origin": self.node_id, "data": data})
+        if len(payload.encode("utf-8")) > self.MAX_PAYLOAD_SIZE:
+            logger.error(f"Broker payload for user {user_uuid} exceeds the NOTIFY size limit and was dropped")
+            return
+        await self._publish_pool.execute("SELECT pg_notify($1, $2)", self._channel(user_uuid), payload)
+
+
+def get_message_broker() -> MessageBroker:
+    if config.MESSAGE_BROKER_BACKEND == "postgres":
+        return PostgresBroker(config.MESSAGE_BROKER_URL)
+    return InMemoryBroker()
+
+
+@dataclass
+class CompressionCounters:
+    frames: int = 0
+    compressed_frames: int = 0
+    raw_bytes: int = 0
+    compressed_bytes: int = 0
+    cpu_ms: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "frames": self.frames,
+            "compressed_frames": self.compressed_frames,
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "ratio": round(self.raw_bytes / self.compressed_bytes, 3) if self.compressed_bytes else None,
+            "cpu_ms": round(self.cpu_ms, 3),
+        }
+
+
+def is_frame_oversized(frame: Union[str, bytes], limit: int) -> bool:
+    """Whether the frame is larger than `limit` bytes, without encoding text frames unless they are close to it"""
+    if isinstance(frame, bytes) or frame.isascii():
+        return len(frame) > limit
+    # A character takes 1 to 4 bytes in UTF-8
+    if len(frame) > limit:
+        return True
+    if len(frame) * 4 <= limit:
+        return False
+    return len(frame.encode("utf-8")) > limit
+
+
+class FrameCompressor:
+    """
+    Deflates outbound frames of at least `threshold` encoded bytes into binary zlib frames, so small events
+    like NEW_MESSAGE_RECEIVED skip the compression CPU. Keeps per-action counters for the metrics.
+    """
+
+    def __init__(self, threshold: int, level: int) -> None:
+        self.threshold = threshold
+        self.level = level
+        self.counters: Dict[str, CompressionCounters] = {}
+
+    def compress(self, frame, payload: bytes) -> Optional[bytes]:
+        action = frame.get("action") if isinstance(frame, dict) else getattr(frame, "action", None)
+        counters = self.counters.setdefault(getattr(action, "value", action) or "None", CompressionCounters())
+        counters.frames += 1
+        if len(payload) < self.threshold:
+            return None
+
+        started_at = time.thread_time()
+        compressed = zlib.compress(payload, self.level)
+        counters.cpu_ms += (time.thread_time() - started_at) * 1000
+        counters.compressed_frames += 1
+        counters.raw_bytes += len(payload)
+        counters.compressed_bytes += len(compressed)
+        return compressed
+
+    def to_dict(self) -> dict:
+        return {action: counters.to_dict() for action, counters in self.counters.items()}
+
+
+class OutboundQueue:
+    """
+    Per-connection outbound buffer drained by a single writer task, so producers never await the network.
+    Bursts are coalesced into BATCH frames of up to OUTBOUND_MAX_BATCH events, and a consumer that lets the queue
+    reach OUTBOUND_QUEUE_HIGH_WATER_MARK has new frames dropped or is disconnected, depending on the policy.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        codec: JsonCodec,
+        binary: bool = False,
+        compressor: Optional[FrameCompressor] = None,
+    ) -> None:
+        self.websocket = websocket
+        self.codec = codec
+        self.binary = binary or codec.binary
+        self.compressor = compressor
+        self.frames: deque = deque()
+        self.ready = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.closed = False
+        self.dropped = 0
+        self.slow_consumer = False
+        self.writer = asyncio.create_task(self._write())
+        self.closer: Optional[asyncio.Task] = None
+
+    def put(self, data) -> bool:
+        if self.closed:
+            return False
+        if len(self.frames) >= config.OUTBOUND_QUEUE_HIGH_WATER_MARK:
+            self._handle_slow_consumer()
+            return False
+        self.frames.append(data)
+        self.idle.clear()
+        self.ready.set()
+        return True
+
+    def _handle_slow_consumer(self) -> None:
+        if config.OUTBOUND_SLOW_CONSUMER_POLICY == "drop":
+            self.dropped += 1
+            return
+        self.closed = self.slow_consumer = True
+        self.frames.clear()
+        self.writer.cancel()
+        self.closer = asyncio.create_task(self._close(code=1013, reason="Slow consumer"))
+
+    async def _close(self, code: int, reason: str) -> None:
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception as exc:
+            logger.warning(f"Failed to close slow consumer socket: {exc}")
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.frames:
+                    if config.OUTBOUND_MAX_BATCH > 1 and len(self.frames) > 1:
+                        batch = [
+                            self.frames.popleft() for _ in range(min(config.OUTBOUND_MAX_BATCH, len(self.frames)))
+                        ]
+                        await self._send({"action": WebSocketActions.BATCH, "data": batch})
+                    else:
+                        await self._send(self.frames.popleft())
+                self.idle.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning(f"Outbound writer stopped: {exc}")
+            self.closed = True
+            self.frames.clear()
+            self.idle.set()
+
+    async def _send(self, frame) -> None:
+        payload = self.codec.encode(frame)
+        if self.compressor is not None:
+            compressed = self.compressor.compress(frame, payload)
+            if compressed is not None:
+                return await self.websocket.send_bytes(COMPRESSED_FRAME_MARKER + compressed)
+            if self.binary:
+                return await self.websocket.send_bytes(PLAIN_FRAME_MARKER + payload)
+        if self.binary:
+            await self.websocket.send_bytes(payload)
+        else:
+            await self.websocket.send_text(payload.decode("utf-8"))
+
+    async def aclose(self, timeout: float = 1.0) -> None:
+        """
+        Stops accepting frames, gives the writer `timeout` seconds to flush what is queued, then stops it.
+        A pending slow consumer close gets the same `timeout`
+        """
+        self.closed = True
+        if not self.writer.done():
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.writer.cancel()
+        if self.closer is not None and not self.closer.done():
+            try:
+                # Cancelled on timeout
+                await asyncio.wait_for(self.closer, timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated user bound to a connection"""
+
+    id: int
+    uuid: uuid.UUID
+    email: str
+    nickname: str
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(id=user.id, uuid=user.uuid, email=user.email, nickname=user.nickname)
+
+
+@dataclass
+class ConnectionSession:
+    """Metadata of a single accepted WebSocket connection"""
+
+    websocket: WebSocket
+    principal: Optional[Principal] = None
+    # JWT the principal was authenticated with and its wall-clock expiry
+    token: Optional[str] = None
+    token_expires_at: float = 0.0
+    # Last encrypted token seen on this socket and its decrypted JWT, so repeated frames skip AES-GCM
+    encrypted_token: Optional[str] = None
+    decrypted_token: Optional[str] = None
+    connected_at: float = field(default_factory=time.monotonic)
+    codec: Optional[JsonCodec] = None
+    outbound: Optional[OutboundQueue] = None
+    # Heartbeat: id of the last PING, when it was sent (None once answered) and the last round trip
+    ping_id: int = 0
+    ping_sent_at: Optional[float] = None
+    heartbeat_rtt_ms: Optional[float] = None
+
+    @property
+    def user_uuid(self) -> Optional[uuid.UUID]:
+        return self.principal.uuid if self.principal else None
+
+
+class ConnectionManager:
+    def __init__(self, broker: Optional[MessageBroker] = None) -> None:
+        # Two-way index: socket -> session metadata and user -> every socket (device) of that user
+        self.active_connections: Dict[WebSocket, ConnectionSession] = {}
+        self.user_to_sockets: Dict[uuid.UUID, Set[WebSocket]] = {}
+
+        self.node_id = uuid.uuid4().hex
+        self.broker = broker or get_message_broker()
+        self.codec = get_codec(config.WEBSOCKET_CODEC)
+        self.compressor = FrameCompressor(config.WEBSOCKET_COMPRESSION_THRESHOLD, config.WEBSOCKET_COMPRESSION_LEVEL)
+
+        # Called with every event delivered to a user through this process, and with every user this process stops
+        # holding (its events no longer reach this process then)
+        self.event_listeners: list[EventListener] = []
+        self.release_listeners: list[Callable[[uuid.UUID], None]] = []
+
+        self.slow_consumer_disconnects = 0
+        self.oversized_frames = 0
+        self.idle_disconnects = 0
+        self.heartbeat_timeouts = 0
+        self.dropped_frames = 0
+        self.heartbeat_rtt = LatencyHistogram()
+
+    async def start(self) -> None:
+        await self.broker.start(self.node_id, self._deliver_locally)
+
+    async def stop(self) -> None:
+        await self.broker.stop()
+
+    async def connect(self, websocket: WebSocket) -> None:
+        subprotocol, codec, compressed, heartbeat = self.negotiate_codec(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        self.active_connections[websocket] = ConnectionSession(
+            websocket=websocket,
+            codec=codec,
+            outbound=OutboundQueue(
+                websocket,
+                codec,
+                binary=config.WEBSOCKET_BINARY_FRAMES,
+                compressor=self.compressor if compressed else None,
+            ),
+        )
+        if config.WEBSOCKET_IDLE_TIMEOUT:
+            timer_wheel.schedule(
+                ("idle", websocket), config.WEBSOCKET_IDLE_TIMEOUT, lambda: self._close_idle(websocket)
+            )
+        if heartbeat:
+            timer_wheel.schedule(
+                ("heartbeat", websocket), config.WEBSOCKET_HEARTBEAT_INTERVAL, lambda: self._send_ping(websocket)
+            )
+
+    def negotiate_codec(self, websocket: WebSocket) -> Tuple[Optional[str], JsonCodec, bool, bool]:
+        """
+        First subprotocol offered by the client that the server supports and whether it asks for compression and
+        for the heartbeat, JSON text frames without either otherwise
+        """
+        for subprotocol in websocket.scope.get("subprotocols") or []:
+            name, compressed, heartbeat = subprotocol, False, False
+            if name.endswith(HEARTBEAT_SUBPROTOCOL_SUFFIX):
+                name, heartbeat = name.removesuffix(HEARTBEAT_SUBPROTOCOL_SUFFIX), True
+            if name.endswith(COMPRESSION_SUBPROTOCOL_SUFFIX):
+                name, compressed = name.removesuffix(COMPRESSION_SUBPROTOCOL_SUFFIX), True
+            if (compressed and not config.WEBSOCKET_COMPRESSION) or (
+                heartbeat and not config.WEBSOCKET_HEARTBEAT_INTERVAL
+            ):
+                continue
+            codec = get_subprotocol_codec(name, self.codec)
+            if codec is not None:
+                return subprotocol, codec, compressed, heartbeat
+        return None, self.codec, False, False
+
+    async def get_json(self, websocket: WebSocket):
+        return self.decode_frame(websocket, await self.receive_frame(websocket))
+
+    async def receive_frame(self, websocket: WebSocket) -> Union[str, bytes]:
+        """Raw text or binary frame, so it can be inspected before decoding"""
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        timer_wheel.extend(("idle", websocket), config.WEBSOCKET_IDLE_TIMEOUT)
+        data = message.get("text")
+        return data if data is not None else message.get("bytes")
+
+    def decode_frame(self, websocket: WebSocket, frame: Union[str, bytes]):
+        session = self.active_connections.get(websocket)
+        codec = session.codec if session and session.codec else self.codec
+        return codec.decode(frame)
+
+    async def send_json(self, data, websocket: WebSocket):
+        """
+        Enqueues the frame (a dict or a pydantic model) on the connection's outbound queue,
+        the encoding and the network write happen in its writer task
+        """
+        session = self.active_connections.get(websocket)
+        if session is None or session.outbound is None:
+            return await websocket.send_text(self.codec.encode(data).decode("utf-8"))
+        session.outbound.put(data)
+
+    async def bind_user(self, websocket: WebSocket, principal: Principal, token: str, token_expires_at: float) -> None:
+        session = self.active_connections.get(websocket)
+        if session is None:
+            return
+        # The socket maps are updated before any await, the broker only follows the 0 -> 1 and 1 -> 0 transitions
+        released = None
+        if session.principal is not None and session.principal.uuid != principal.uuid:
+            released = self._release(websocket)
+        session.principal = principal
+        session.token = token
+        session.token_expires_at = token_expires_at
+
+        sockets = self.user_to_sockets.setdefault(principal.uuid, set())
+        first = not sockets
+        sockets.add(websocket)
+
+        if released is not None:
+            await self._sync_subscription(released)
+        if first:
+            # Only users held by this process are subscribed to
+            await self._sync_subscription(principal.uuid)
+
+    async def unbind_user(self, websocket: WebSocket) -> Optional[uuid.UUID]:
+        session = self.active_connections.get(websocket)
+        if session is None or session.principal is None:
+            return None
+
+        user_uuid = session.principal.uuid
+        if self._release(websocket) is not None:
+            await self._sync_subscription(user_uuid)
+        return user_uuid
+
+    def _release(self, websocket: WebSocket) -> Optional[uuid.UUID]:
+        """Detaches the socket from its user, returns the user if it was their last socket here"""
+        session = self.active_connections[websocket]
+        user_uuid = session.principal.uuid
+        session.principal = session.token = None
+        session.token_expires_at = 0.0
+        sockets = self.user_to_sockets.get(user_uuid)
+        if sockets is None:
+            return None
+        sockets.discard(websocket)
+        if sockets:
+            return None
+        del self.user_to_sockets[user_uuid]
+        for listener in self.release_listeners:
+            listener(user_uuid)
+        return user_uuid
+
+    async def _sync_subscription(self, user_uuid: uuid.UUID) -> None:
+        """
+        Subscribes the user while they have sockets here and unsubscribes them once they have none. The broker
+        serializes the calls under its lock, so the last transition always wins
+        """
+        if user_uuid in self.user_to_sockets:
+            await self.broker.subscribe(user_uuid)
+        else:
+            await self.broker.unsubscribe(user_uuid)
+
+    def get_principal(self, websocket: WebSocket, token: str) -> Optional[Principal]:
+        """Cached principal of the socket, if it was authenticated with this token and the token has not expired"""
+        session = self.active_connections.get(websocket)
+        if session is None or session.principal is None or session.token != token:
+            return None
+        if session.token_expires_at <= time.time():
+            return None
+        return session.principal
+
+    def get_decrypted_token(self, websocket: WebSocket, encrypted_token: str) -> Optional[str]:
+        session = self.active_connections.get(websocket)
+        if session is None or session.encrypted_token != encrypted_token:
+            return None
+        return session.decrypted_token
+
+    def remember_decrypted_token(self, websocket: WebSocket, encrypted_token: str, token: str) -> None:
+        session = self.active_connections.get(websocket)
+        if session is not None:
+            session.encrypted_token = encrypted_token
+            session.decrypted_token = token
+
+    def get_user_sockets(self, user_uuid: uuid.UUID) -> Set[WebSocket]:
+        return self.user_to_sockets.get(user_uuid, set())
+
+    def get_user_uuid(self, websocket: WebSocket) -> Optional[uuid.UUID]:
+        session = self.active_connections.get(websocket)
+        return session.user_uuid if session else None
+
+    async def _deliver_locally(self, user_uuid: uuid.UUID, data: dict, exclude: Optional[WebSocket] = None) -> None:
+        for listener in self.event_listeners:
+            listener(user_uuid, data)
+        for websocket in list(self.get_user_sockets(user_uuid)):
+            if websocket is not exclude:
+                await self.send_json(data, websocket)
+
+    async def _close_idle(self, websocket: WebSocket) -> None:
+        """Closes a socket that sent nothing for WEBSOCKET_IDLE_TIMEOUT, its receive loop then cleans it up"""
+        if websocket not in self.active_connections:
+            return
+        self.idle_disconnects += 1
+        try:
+            await websocket.close(code=1000, reason="Idle timeout")
+        except Exception as exc:
+            logger.warning(f"Failed to close idle socket: {exc}")
+
+    def _send_ping(self, websocket: WebSocket) -> None:
+        session = self.active_connections.get(websocket)
+        if session is None or session.outbound is None:
+            return
+        session.ping_id += 1
+        session.ping_sent_at = time.monotonic()
+        # Queued like any other frame, so the round trip also covers a backed up outbound queue
+        session.outbound.put({"action": WebSocketActions.PING, "data": {"id": session.ping_id}})
+        timer_wheel.schedule(
+            ("heartbeat", websocket), config.WEBSOCKET_HEARTBEAT_TIMEOUT, lambda: self._close_unresponsive(websocket)
+        )
+
+    def handle_pong(self, websocket: WebSocket, data: Optional[dict]) -> None:
+        """Records the round trip of the PING being answered and schedules the next one, stale PONGs are ignored"""
+        session = self.active_connections.get(websocket)
+        if session is None or session.ping_sent_at is None or not isinstance(data, dict):
+            return
+        if data.get("id") != session.ping_id:
+            return
+        session.heartbeat_rtt_ms = (time.monotonic() - session.ping_sent_at) * 1000
+        session.ping_sent_at = None
+        self.heartbeat_rtt.observe(session.heartbeat_rtt_ms)
+        timer_wheel.schedule(
+            ("heartbeat", websocket), config.WEBSOCKET_HEARTBEAT_INTERVAL, lambda: self._send_ping(websocket)
+        )
+
+    async def _close_unresponsive(self, websocket: WebSocket) -> None:
+        """Closes a socket that missed a PONG, its receive loop then cleans it up"""
+        if websocket not in self.active_connections:
+            return
+        self.heartbeat_timeouts += 1
+        try:
+            await websocket.close(code=1011, reason="Heartbeat timeout")
+        except Exception as exc:
+            logger.warning(f"Failed to close unresponsive socket: {exc}")
+
+    async def send_to_user(self, user_uuid: uuid.UUID, data: dict, exclude: Optional[WebSocket] = None) -> None:
+        """
+        Deliver an event to every device of the user, whichever process it is connected to, except the `exclude`
+        socket (e.g. the one the change was made from, which gets the action's response instead)
+        """
+        await self._deliver_locally(user_uuid, data, exclude)
+        try:
+            await self.broker.publish(user_uuid, data)
+        except Exception as exc:
+            # The change itself is saved, only the other processes miss the event
+            logger.error(f"Failed to publish event to user {user_uuid}: {exc}")
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        remove_websocket_by_value(self.socket_to_user, websocket)
-        websocket.close()
+    async def disconnect(self, websocket: WebSocket):
+        timer_wheel.cancel(("idle", websocket))
+        timer_wheel.cancel(("heartbeat", websocket))
+        try:
+            await self.unbind_user(websocket)
+        except Exception as exc:
+            logger.error(f"Failed to unsubscribe disconnected socket: {exc}")
+        finally:
+            session = self.active_connections.pop(websocket, None)
+            if session is not None and session.outbound is not None:
+                await session.outbound.aclose()
+                self.dropped_frames += session.outbound.dropped
+                self.slow_consumer_disconnects += session.outbound.slow_consumer
 
     async def send_message(self, message: str):
-        for connection in self.active_connections:
+        for connection in list(self.active_connections):
             await connection.send_text(message)
 
 
@@ -0,0 +1,9 @@
+#!/usr/bin/env bash
+# exit on error
+set -o errexit
+
+# Large frames are compressed by the app for "+deflate" clients, permessage-deflate would compress them a second time.
+# The client IP the per-IP limits key on is taken from X-Forwarded-For only when it comes from FORWARDED_ALLOW_IPS,
+# set it to the reverse proxy's address before enabling them
+uvicorn main:app --host 0.0.0.0 --port "${PORT:-8000}" --ws-per-message-deflate false \
+  --proxy-headers --forwarded-allow-ips "${FORWARDED_ALLOW_IPS:-127.0.0.1}"
@@ -17,12 +17,100 @@ if IS_DEPLOY_BRANCH:
 else:
     DATABASE_URL = env.str("DEFAULT_DATABASE_URL")
 
+# "queue" - warm connection pool, "pgbouncer" - warm pool with statement caches disabled for transaction-mode
+# PgBouncer, "null" - new connection per session (no pooling)
+DATABASE_POOL_PROFILE = env.str("DATABASE_POOL_PROFILE", "pgbouncer" if IS_DEPLOY_BRANCH else "queue")
+DATABASE_POOL_SIZE = env.int("DATABASE_POOL_SIZE", 10)
+DATABASE_MAX_OVERFLOW = env.int("DATABASE_MAX_OVERFLOW", 20)
+DATABASE_POOL_TIMEOUT = env.int("DATABASE_POOL_TIMEOUT", 30)
+# Time should be in seconds
+DATABASE_POOL_RECYCLE = env.int("DATABASE_POOL_RECYCLE", 1800)
+DATABASE_POOL_PRE_PING = env.bool("DATABASE_POOL_PRE_PING", True)
+DATABASE_ECHO = env.bool("DATABASE_ECHO", False)
+
+# "memory" keeps deliveries inside one process, "postgres" fans them out to every worker via LISTEN/NOTIFY
+MESSAGE_BROKER_BACKEND = env.str("MESSAGE_BROKER_BACKEND", "memory")
+MESSAGE_BROKER_URL = env.str("MESSAGE_BROKER_URL", (DATABASE_URL or "").replace("+asyncpg", ""))
+MESSAGE_BROKER_POOL_SIZE = env.int("MESSAGE_BROKER_POOL_SIZE", 5)
+
+# Maximum number of pipelined (request_id carrying) actions handled concurrently for one socket
+PIPELINE_MAX_IN_FLIGHT = env.int("PIPELINE_MAX_IN_FLIGHT", 4)
+
+# Outbound frames queued per socket before the slow consumer policy ("disconnect" or "drop") kicks in
+OUTBOUND_QUEUE_HIGH_WATER_MARK = env.int("OUTBOUND_QUEUE_HIGH_WATER_MARK", 256)
+OUTBOUND_SLOW_CONSUMER_POLICY = env.str("OUTBOUND_SLOW_CONSUMER_POLICY", "disconnect")
+# Maximum number of queued frames coalesced into one BATCH frame, 1 disables coalescing
+OUTBOUND_MAX_BATCH = env.int("OUTBOUND_MAX_BATCH", 1)
+
+# WebSocket frame codec: "auto" (orjson or msgspec if installed, stdlib json otherwise), "orjson", "msgspec", "json"
+WEBSOCKET_CODEC = env.str("WEBSOCKET_CODEC", "auto")
+WEBSOCKET_BINARY_FRAMES = env.bool("WEBSOCKET_BINARY_FRAMES", False)
+# Whether "+deflate" subprotocols are accepted, and the encoded size (in bytes) from which their frames are compressed
+WEBSOCKET_COMPRESSION = env.bool("WEBSOCKET_COMPRESSION", True)
+WEBSOCKET_COMPRESSION_THRESHOLD = env.int("WEBSOCKET_COMPRESSION_THRESHOLD", 1024)
+WEBSOCKET_COMPRESSION_LEVEL = env.int("WEBSOCKET_COMPRESSION_LEVEL", 6)
+# Maximum size (in bytes) of an inbound frame per action class: REGISTER/LOGIN, SEND_MESSAGE and everything else.
+# Frames above the largest limit are refused before they are decoded, the others as soon as their action is known,
+# before the payload is validated; both close the socket with 1009. Run uvicorn with `--ws-max-size` set to
+# WEBSOCKET_MAX_FRAME_SIZE to refuse larger frames while they are still being received
+WEBSOCKET_AUTH_FRAME_SIZE = env.int("WEBSOCKET_AUTH_FRAME_SIZE", 4 * 1024)
+WEBSOCKET_MESSAGE_FRAME_SIZE = env.int("WEBSOCKET_MESSAGE_FRAME_SIZE", 64 * 1024)
+WEBSOCKET_DEFAULT_FRAME_SIZE = env.int("WEBSOCKET_DEFAULT_FRAME_SIZE", 8 * 1024)
+WEBSOCKET_MAX_FRAME_SIZE = max(WEBSOCKET_AUTH_FRAME_SIZE, WEBSOCKET_MESSAGE_FRAME_SIZE, WEBSOCKET_DEFAULT_FRAME_SIZE)
+# Token bucket limits of inbound frames per connection and per client IP: the sustained rate per minute and the
+# burst allowed on top of it, 0 disables a limit. Same for the number of simultaneous connections per IP
+WEBSOCKET_RATE_LIMIT_PER_MINUTE = env.int("WEBSOCKET_RATE_LIMIT_PER_MINUTE", 100)
+WEBSOCKET_RATE_LIMIT_BURST = env.int("WEBSOCKET_RATE_LIMIT_BURST", 20)
+# The per-IP limits are off by default: behind a proxy every client shares the proxy's address unless uvicorn
+# trusts its X-Forwarded-For headers, so set FORWARDED_ALLOW_IPS to the proxy's address (see start.sh) first
+WEBSOCKET_IP_RATE_LIMIT_PER_MINUTE = env.int("WEBSOCKET_IP_RATE_LIMIT_PER_MINUTE", 0)
+WEBSOCKET_IP_RATE_LIMIT_BURST = env.int("WEBSOCKET_IP_RATE_LIMIT_BURST", 60)
+WEBSOCKET_MAX_CONNECTIONS_PER_IP = env.int("WEBSOCKET_MAX_CONNECTIONS_PER_IP", 0)
+# Seconds an IP that exhausts its shared rate limit is refused for, 0 disables bans
+WEBSOCKET_IP_BAN_SECONDS = env.int("WEBSOCKET_IP_BAN_SECONDS", 0)
+# Sockets that send no frame for this many seconds are closed, 0 keeps them open
+WEBSOCKET_IDLE_TIMEOUT = env.int("WEBSOCKET_IDLE_TIMEOUT", 60 * 60)
+# Sockets that offered a "+heartbeat" subprotocol are sent a PING this many seconds after their last PONG (0 refuses
+# those subprotocols), and are closed when the PONG does not arrive within the timeout
+WEBSOCKET_HEARTBEAT_INTERVAL = env.int("WEBSOCKET_HEARTBEAT_INTERVAL", 30)
+WEBSOCKET_HEARTBEAT_TIMEOUT = env.int("WEBSOCKET_HEARTBEAT_TIMEOUT", 20)
+# Inbound frames are scanned for suspicious content up to this many characters (bytes for binary frames),
+# and for at most this many milliseconds
+SUSPICIOUS_CONTENT_MAX_SCAN_SIZE = env.int("SUSPICIOUS_CONTENT_MAX_SCAN_SIZE", 256 * 1024)
+SUSPICIOUS_CONTENT_SCAN_BUDGET_MS = env.float("SUSPICIOUS_CONTENT_SCAN_BUDGET_MS", 5.0)
+
 # Time should be in minutes
 ACCESS_TOKEN_EXPIRATION_TIME = env.int("ACCESS_TOKEN_EXPIRATION_TIME", 60)
 ENCRYPTION_ALGORITHM = EncryptionAlgorithms.HS384
 IV_LENGTH = env.int("IV_LENGTH", 16)
 TAG_LENGTH = env.int("TAG_LENGTH", 16)
 JWT_AES_KEY = os.urandom(32)
+# bcrypt runs in its own thread pool, so login bursts queue up there instead of blocking the event loop
+PASSWORD_HASHING_WORKERS = env.int("PASSWORD_HASHING_WORKERS", 4)
+
+# Time should be in seconds
+TOKEN_BLACKLIST_SYNC_INTERVAL = env.int("TOKEN_BLACKLIST_SYNC_INTERVAL", 5)
+# Seconds of already synced revocations scanned again, covering late commits and clock skew between workers
+TOKEN_BLACKLIST_SYNC_OVERLAP = env.int("TOKEN_BLACKLIST_SYNC_OVERLAP", 60)
+TOKEN_BLACKLIST_BLOOM_CAPACITY = env.int("TOKEN_BLACKLIST_BLOOM_CAPACITY", 100_000)
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = env.float("TOKEN_BLACKLIST_BLOOM_ERROR_RATE", 0.001)
+
+CHAT_MESSAGES_PAGE_SIZE = env.int("CHAT_MESSAGES_PAGE_SIZE", 50)
+CHAT_MESSAGES_MAX_PAGE_SIZE = env.int("CHAT_MESSAGES_MAX_PAGE_SIZE", 200)
+USERS_PAGE_SIZE = env.int("USERS_PAGE_SIZE", 50)
+USERS_MAX_PAGE_SIZE = env.int("USERS_MAX_PAGE_SIZE", 200)
+# Chats whose participants are kept in memory, entries expire after the TTL (in seconds)
+CHAT_MEMBERSHIP_CACHE_SIZE = env.int("CHAT_MEMBERSHIP_CACHE_SIZE", 100_000)
+CHAT_MEMBERSHIP_CACHE_TTL = env.int("CHAT_MEMBERSHIP_CACHE_TTL", 300)
+# Optional write-behind of chat messages: buffered rows are written every INTERVAL_MS or BATCH_SIZE messages.
+# ACK is "durable" (SEND_MESSAGE is answered once the row is committed) or "delivered" (once it is fanned out)
+MESSAGE_WRITE_BEHIND = env.bool("MESSAGE_WRITE_BEHIND", False)
+MESSAGE_WRITE_BEHIND_INTERVAL_MS = env.int("MESSAGE_WRITE_BEHIND_INTERVAL_MS", 50)
+MESSAGE_WRITE_BEHIND_BATCH_SIZE = env.int("MESSAGE_WRITE_BEHIND_BATCH_SIZE", 500)
+MESSAGE_WRITE_BEHIND_MAX_PENDING = env.int("MESSAGE_WRITE_BEHIND_MAX_PENDING", 10_000)
+MESSAGE_WRITE_BEHIND_ACK = env.str("MESSAGE_WRITE_BEHIND_ACK", "durable")
+# Users whose conversation list (GET_CHATS) is kept in memory, least recently used ones are evicted first
+CONVERSATION_CACHE_MAX_USERS = env.int("CONVERSATION_CACHE_MAX_USERS", 10000)
 
 try:
     JWT_SECRET = generate_jwt_secret_key(env.int("JWT_RANDOM_BYTES_LENGTH", 64))
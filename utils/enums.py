@@ -33,13 +33,28 @@ class WebSocketActions(str, Enum):
     ME = ("ME",)
 
     NEW_MESSAGE_RECEIVED = "NEW_MESSAGE_RECEIVED"
-
-
-SCHEMA_TO_ACTION_MAPPER = {
-    "UserLogin": WebSocketActions.LOGIN,
-    "UserCreate": WebSocketActions.REGISTER,
-    "UserListResponse": WebSocketActions.GET_USERS,
-}
+    # A chat the user takes part in was created, `data` is the chat as GET_CHATS lists it
+    CHAT_CREATED = "CHAT_CREATED"
+    # The user read the chat `data.chat_uuid` on another device
+    CHAT_READ = "CHAT_READ"
+    # Heartbeat, only for sockets that offered a "+heartbeat" subprotocol (e.g. "chat.v1.json+heartbeat"):
+    # the server sends {"action": "PING", "data": {"id": <int>}} WEBSOCKET_HEARTBEAT_INTERVAL seconds after the
+    # previous PONG, and the client answers {"action": "PONG", "data": {"id": <same id>}}. A socket that does not
+    # answer within WEBSOCKET_HEARTBEAT_TIMEOUT seconds is closed with 1011. A PING may arrive inside a BATCH
+    PING = "PING"
+    PONG = "PONG"
+    # Several outbound frames coalesced into one, `data` holds the original frames in order
+    BATCH = "BATCH"
+
+
+class WebSocketSubprotocols(str, Enum):
+    # Either can be suffixed with "+deflate": outbound frames above the size threshold are then sent as binary zlib
+    # streams. Every binary frame the server sends on such a socket starts with a marker byte, 0x01 for a zlib stream
+    # and 0x00 for a plain encoded frame, followed by the frame itself. Text frames and inbound frames carry no marker
+    # Either can also be suffixed with "+heartbeat" (after "+deflate" when both are used) to opt into PING frames
+    JSON = "chat.v1.json"
+    # Binary MessagePack frames, needs msgspec
+    MSGPACK = "chat.v1.msgpack"
 
 
 class ResponseStatuses(str, Enum):
@@ -35,7 +35,7 @@ class EnvParser:
     @staticmethod
     def bool(var_name, default=False):
         """Get environment variable as boolean."""
-        value = os.getenv(var_name, default)
+        value = os.getenv(var_name)
         if value is None:
             return default
         return value.lower() in ["true", "1", "yes", "on"]
@@ -0,0 +1,23 @@
+import bisect
+
+
+class LatencyHistogram:
+    # Upper bounds of the buckets, in milliseconds
+    BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, duration_ms: float) -> None:
+        self.counts[bisect.bisect_left(self.BUCKETS, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+
+    def to_dict(self) -> dict:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.BUCKETS, self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"count": self.count, "sum_ms": round(self.total_ms, 3), "buckets": buckets}
@@ -0,0 +1,110 @@
+import json
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from utils.enums import WebSocketSubprotocols
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+    import msgspec.msgpack
+except ImportError:
+    msgspec = None
+
+
+def to_builtins(obj: Any) -> Any:
+    """Fallback hook for objects the encoders do not support natively"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+class JsonCodec:
+    """
+    Stdlib JSON codec. Every codec encodes straight to bytes, and pydantic models are serialized by pydantic-core
+    without an intermediate dict.
+    """
+
+    name = "json"
+    binary = False
+
+    def encode(self, obj: Any) -> bytes:
+        if isinstance(obj, BaseModel):
+            return obj.__pydantic_serializer__.to_json(obj)
+        return self.dumps(obj)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=to_builtins).encode("utf-8")
+
+    def decode(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=to_builtins)
+
+    def decode(self, data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        self.encoder = msgspec.json.Encoder(enc_hook=to_builtins)
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.encoder.encode(obj)
+
+    def decode(self, data: str | bytes) -> Any:
+        return self.decoder.decode(data)
+
+
+class MsgpackCodec(JsonCodec):
+    """MessagePack over binary frames, frames keep the same shape as the JSON ones"""
+
+    name = "msgpack"
+    binary = True
+
+    def __init__(self) -> None:
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=to_builtins)
+        self.decoder = msgspec.msgpack.Decoder()
+
+    def encode(self, obj: Any) -> bytes:
+        if isinstance(obj, BaseModel):
+            obj = obj.__pydantic_serializer__.to_python(obj, mode="json")
+        return self.encoder.encode(obj)
+
+    def decode(self, data: str | bytes) -> Any:
+        if isinstance(data, str):
+            raise ValueError("MessagePack connections accept binary frames only")
+        return self.decoder.decode(data)
+
+
+def get_subprotocol_codec(subprotocol: str, default: JsonCodec) -> Optional[JsonCodec]:
+    """Codec of a WebSocket subprotocol offered by the client, None when it is unknown or not installed"""
+    if subprotocol == WebSocketSubprotocols.JSON:
+        return default
+    if subprotocol == WebSocketSubprotocols.MSGPACK and msgspec is not None:
+        return MsgpackCodec()
+    return None
+
+
+def get_codec(name: str = "auto") -> JsonCodec:
+    """Codec by name, "auto" picks the fastest installed one"""
+    if name in ("orjson", "auto") and orjson is not None:
+        return OrjsonCodec()
+    if name in ("msgspec", "auto") and msgspec is not None:
+        return MsgspecCodec()
+    if name not in ("json", "auto"):
+        raise ValueError(f"Codec {name!r} is not available")
+    return JsonCodec()
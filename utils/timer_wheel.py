@@ -0,0 +1,113 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Set, Union
+
+from utils.logging_config import logger
+
+TimerCallback = Callable[[], Union[Awaitable[None], None]]
+
+
+@dataclass
+class Timer:
+    deadline: float
+    callback: TimerCallback
+    slot: int
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel for many long, frequently extended timeouts (e.g. idle sockets). Every `tick` seconds only the
+    slot of the current tick is visited, so the cost is proportional to the timers that are due, not to all of them.
+    Extending a timer only updates its deadline; it is moved to its new slot when its old slot comes up.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512) -> None:
+        self.tick = tick
+        self.slots: list[Set[Hashable]] = [set() for _ in range(slots)]
+        self.timers: Dict[Hashable, Timer] = {}
+        self.current_tick = self._to_tick(time.monotonic())
+        self.runner: Optional[asyncio.Task] = None
+        self.callbacks: Set[asyncio.Task] = set()
+        self.expired = 0
+
+    def start(self) -> None:
+        if self.runner is None:
+            self.current_tick = self._to_tick(time.monotonic())
+            self.runner = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self.runner is not None:
+            self.runner.cancel()
+            self.runner = None
+
+    def schedule(self, key: Hashable, delay: float, callback: TimerCallback) -> None:
+        """Calls `callback` in `delay` seconds unless extended or cancelled, replaces an existing timer of the key"""
+        self.cancel(key)
+        deadline = time.monotonic() + delay
+        slot = self._to_slot(deadline)
+        self.timers[key] = Timer(deadline, callback, slot)
+        self.slots[slot].add(key)
+
+    def extend(self, key: Hashable, delay: float) -> None:
+        """Moves the deadline to `delay` seconds from now, in O(1)"""
+        timer = self.timers.get(key)
+        if timer is not None:
+            timer.deadline = max(timer.deadline, time.monotonic() + delay)
+
+    def cancel(self, key: Hashable) -> None:
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            self.slots[timer.slot].discard(key)
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def expire(self, now: float) -> list[TimerCallback]:
+        """Removes the timers due by `now` and returns their callbacks"""
+        due = []
+        target_tick = self._to_tick(now)
+        # After a long stall every slot is visited once
+        first_tick = max(self.current_tick + 1, target_tick - len(self.slots) + 1)
+        for tick in range(first_tick, target_tick + 1):
+            slot = tick % len(self.slots)
+            for key in list(self.slots[slot]):
+                timer = self.timers[key]
+                if timer.deadline <= now:
+                    del self.timers[key]
+                    self.slots[slot].discard(key)
+                    due.append(timer.callback)
+                else:
+                    # Extended, or due on a later turn of the wheel
+                    new_slot = self._to_slot(timer.deadline)
+                    if new_slot != slot:
+                        self.slots[slot].discard(key)
+                        self.slots[new_slot].add(key)
+                        timer.slot = new_slot
+        self.current_tick = max(self.current_tick, target_tick)
+        self.expired += len(due)
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            for callback in self.expire(time.monotonic()):
+                try:
+                    result = callback()
+                    if asyncio.iscoroutine(result):
+                        task = asyncio.create_task(result)
+                        self.callbacks.add(task)
+                        task.add_done_callback(self.callbacks.discard)
+                except Exception as exc:
+                    logger.error(f"Timer callback failed: {exc}")
+
+    def _to_tick(self, moment: float) -> int:
+        return int(moment // self.tick)
+
+    def _to_slot(self, deadline: float) -> int:
+        # Rounded up, so a timer is never visited before the tick its deadline falls in has passed, and never
+        # into a tick that was already visited
+        return max(-int(-deadline // self.tick), self.current_tick + 1) % len(self.slots)
+
+
+timer_wheel = TimerWheel()
@@ -1,12 +1,12 @@
+import asyncio
 import base64
 import hashlib
 import os
 import subprocess
-import uuid
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-from fastapi.websockets import WebSocket
-from sqlalchemy import delete
+from sqlalchemy import delete, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -33,16 +33,39 @@ def get_git_branch_name():
 async def cleanup_blacklisted_tokens(db: AsyncSession):
     from api.models import BlacklistedToken
 
-    query = delete(BlacklistedToken)
+    # Only expired rows are removed, other workers may still rely on the rest
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    query = delete(BlacklistedToken).where(
+        or_(BlacklistedToken.expires_at.is_(None), BlacklistedToken.expires_at < now)
+    )
     await db.execute(query)
     await db.commit()
 
 
-def remove_websocket_by_value(socket_to_user: Dict[uuid.UUID, WebSocket], websocket: WebSocket):
-    key_to_remove = None
-    for key, value in socket_to_user.items():
-        if value == websocket:
-            key_to_remove = key
-            break
-    if key_to_remove:
-        del socket_to_user[key_to_remove]
+class BoundedExecutor:
+    """Thread pool for blocking calls with a fixed concurrency limit and a queue depth counter"""
+
+    def __init__(self, max_workers: int, name: str):
+        self.max_workers = max_workers
+        self.name = name
+        self.executor = None
+        self.in_flight = 0
+
+    @property
+    def queue_depth(self) -> int:
+        # Calls waiting for a free worker, running ones are not counted
+        return max(0, self.in_flight - self.max_workers)
+
+    async def run(self, func, *args):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None